@@ -37,6 +37,7 @@ extern void TIMER_A0_config_for_script(void);
 extern void TIMER_A0_config_for_ultrasonic(void);
 extern void ADCsampLDRconfig(void);
 extern void UART_Init(void);
+extern void UART_set_baud(int);
 extern void FlashConfig(void);
 extern void lcd_init(void);
 extern void lcd_cmd(unsigned char);
@@ -115,6 +116,8 @@ extern int seg_flag_arr[3];
 //-------------------------------------------------
 #define TXD                 BIT2
 #define RXD                 BIT1
+#define BAUD_RATES_NUM      5     // 9600 .. 115200, see UART_set_baud()
+#define BAUD_PROBE_LEN      64    // bytes echoed while probing a new baud rate
 
 //-------------------------------------------------
 //Inputs 
@@ -98,6 +98,7 @@ extern void send_opcode();
 extern void send_char(char);
 extern void send_LDR_value();
 extern void send_calib();
+extern int baud_index;
 
 extern void sysConfig(void);
 extern void commConfig(void);
@@ -2,16 +2,29 @@ from __future__ import annotations
 
 import time
 import os
+import json
+import glob
 import math
+import argparse
+import io
+import queue
+import base64
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 
 import serial as ser
+from serial.tools import list_ports
 import matplotlib
 matplotlib.use("TkAgg")
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 
 
 # -----------------------
@@ -19,10 +32,314 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 # -----------------------
 light_epsilon = 0.3
 object_light_epsilon = 0.3
-
-s = None  # serial handle
+light_masking_distance = 50  # [cm] lights further than this are masked
+
+LDR_SCALE = 292              # raw ADC counts per volt as sent by the MSP
+LDR_SWEEP_END = 1023         # LDR1 above this ends a light sweep
+OBJECT_SWEEP_END = 500       # distance terminator of an object sweep
+LIGHT_OBJECT_SWEEP_END = 9999
+
+# scan command -> (mode name, samples skipped while the servo settles)
+SCAN_MODES = {
+    'U': ('object', 5),
+    'Y': ('light', 9),
+    'Z': ('light_object', 5),
+}
+
+command_dict = {
+    "inc_lcd": 0x01,
+    "dec_lcd": 0x02,
+    "rra_lcd": 0x03,
+    "set_delay": 0x04,
+    "clear_lcd": 0x05,
+    "servo_deg": 0x06,
+    "servo_scan": 0x07,
+    "sleep": 0x08
+}
+
+s = None  # serial handle (a ConnectionManager once init_uart ran)
+serial_port = None  # None -> auto-detect the MSP430
 ACK = '0'
 
+# sweep recording (raw lines as received, replayable by the `reanalyze` CLI)
+sweep_record_dir = None
+_sweep_lines = None
+
+calibration_table = None  # fallback LDR lookup table, see lookup_calibration_table
+
+# -----------------------
+# Serial connection manager
+# -----------------------
+
+MSP430_USB_IDS = {(0x0451, 0xF432)}  # TI eZ-FET / LaunchPad application UART
+MENU_COMMANDS = '12345'              # FSM modes worth re-entering after a reconnect
+LINE_TIMEOUT = 5.0                   # [s] silence inside a line before the link is declared dead
+SCRIPT_OPCODE_TIMEOUT = 900.0        # [s] silence between script opcodes before the same
+
+# Baud negotiation ('b' + rate index, see UART_set_baud in bsp.c).  The MSP acks
+# with 'b' at the old rate, echoes BAUD_PROBE_LEN bytes at the new one and keeps
+# it only if the next byte is 'Y'; anything else makes it fall back.
+BAUD_RATES = (9600, 19200, 38400, 57600, 115200)
+BAUD_PROBE_LEN = 64
+BAUD_PROBE_PATTERN = bytes((0x55, 0xAA, 0x00, 0xFF) * 4 +
+                           tuple((i * 37 + 11) & 0xFF for i in range(BAUD_PROBE_LEN - 16)))
+max_baudrate = BAUD_RATES[-1]
+
+
+class LinkReset(ser.SerialException):
+    # The link dropped and was re-established; the read in progress is lost.
+    pass
+
+
+class ConnectionManager:
+    # Drop-in for the serial handle: exposes write/read/read_until, finds the
+    # MSP430 port, and on failure reconnects with backoff, sends '0' to bring
+    # the FSM back to the menu and re-pushes the current mode (plus any resume
+    # bytes, e.g. a running telemeter angle).
+
+    def __init__(self, port=None, baudrate=9600, timeout=1.0, retries=6,
+                 backoff=0.5, max_backoff=8.0, line_timeout=LINE_TIMEOUT):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.serial = None
+        self.device_id = port or 'default'
+        self.mode = None        # last menu command sent ('1'..'5')
+        self.resume = b''       # bytes re-sent after the mode on reconnect
+        self.reconnects = 0
+        self.probe_bps = None   # round-trip throughput measured by the last good probe
+        self.line_timeout = line_timeout
+        self._rx = bytearray()  # bytes read ahead of the current line
+
+    @staticmethod
+    def find_port():
+        ports = list(list_ports.comports())
+        for info in ports:
+            if (info.vid, info.pid) in MSP430_USB_IDS:
+                return info
+        for info in ports:
+            text = f"{info.description} {info.manufacturer or ''}".upper()
+            if 'MSP430' in text or 'TEXAS INSTRUMENTS' in text:
+                return info
+        return None
+
+    def _open_once(self):
+        port = self.port
+        device_id = port
+        if port is None:
+            info = self.find_port()
+            if info is None:
+                raise ser.SerialException("no MSP430 serial port found")
+            port = info.device
+            device_id = info.serial_number or info.device
+        # serial_for_url also accepts socket:// and loop:// for bench setups
+        self.serial = ser.serial_for_url(port, baudrate=self.baudrate, bytesize=ser.EIGHTBITS,
+                                         parity=ser.PARITY_NONE, stopbits=ser.STOPBITS_ONE,
+                                         timeout=self.timeout, write_timeout=self.timeout)
+        self.serial.reset_input_buffer()
+        self.serial.reset_output_buffer()
+        self._rx.clear()
+        self.device_id = device_id
+
+    def open(self):
+        delay = self.backoff
+        for attempt in range(self.retries):
+            try:
+                self._open_once()
+                return self
+            except (ser.SerialException, OSError):
+                self.close()
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, self.max_backoff)
+
+    def close(self):
+        if self.serial is not None:
+            try:
+                self.serial.close()
+            except (ser.SerialException, OSError):
+                pass
+        self.serial = None
+
+    def resync(self):
+        self.serial.write(b'0')
+        time.sleep(0.1)
+        if self.mode is not None:
+            self.serial.write(self.mode.encode('ascii'))
+            time.sleep(0.1)
+            if self.resume:
+                self.serial.write(self.resume)
+        self.serial.reset_input_buffer()
+        self._rx.clear()
+
+    def reconnect(self):
+        self.close()
+        self.open()
+        if self.baudrate != BAUD_RATES[0]:
+            self._restore_baud()
+        self.resync()
+        self.reconnects += 1
+
+    def _try_baud(self, rate):
+        # One negotiation round from the current host rate to `rate`.
+        old_rate = self.serial.baudrate
+        self.serial.reset_input_buffer()
+        self._rx.clear()
+        self.serial.write(b'b' + str(BAUD_RATES.index(rate)).encode('ascii'))
+        acked = self.serial.read(1) == b'b'
+        self.serial.baudrate = rate
+        time.sleep(0.02)
+        start = time.monotonic()
+        echo = b''
+        if acked:
+            self.serial.write(BAUD_PROBE_PATTERN)
+            echo = self.serial.read(BAUD_PROBE_LEN)
+        elapsed = time.monotonic() - start
+        errors = sum(a != b for a, b in zip(echo, BAUD_PROBE_PATTERN)) + BAUD_PROBE_LEN - len(echo)
+        if acked and errors == 0:
+            self.serial.write(b'Y')
+            self.baudrate = rate
+            self.probe_bps = 2 * BAUD_PROBE_LEN / elapsed if elapsed > 0 else None
+            return True
+        if acked:
+            # Top the probe count up in case bytes were lost; the first byte past
+            # it is not 'Y', so the MSP falls back to the old rate.  Without an
+            # ack the MSP never entered the probe (or listens at another rate).
+            self.serial.write(b'N' * (BAUD_PROBE_LEN + 1))
+            time.sleep(0.05)
+        self.serial.baudrate = old_rate
+        time.sleep(0.05)
+        self.serial.reset_input_buffer()
+        if acked:
+            self.serial.write(b'0')  # clear the LCD "ERROR" the stray bytes may leave
+            time.sleep(0.05)
+        return False
+
+    def _restore_baud(self):
+        # After a reconnect the MSP is either still at the negotiated rate or
+        # back at 9600 after a reset; find it and bring it up again.
+        target = self.baudrate
+        for rate in dict.fromkeys((target, BAUD_RATES[0])):
+            self.serial.baudrate = self.baudrate = rate
+            if self._try_baud(target):
+                return
+        self.serial.baudrate = self.baudrate = BAUD_RATES[0]
+
+    def negotiate_baud(self, max_rate=BAUD_RATES[-1]):
+        # Highest rate that passes the echo probe; the last good rate is
+        # remembered per device.  A session that ended without reset_baud
+        # (crash, unplugged) leaves the MSP at that rate, so it is checked as
+        # the current rate first (_restore_baud), before probing upward.
+        profiles = load_device_profiles()
+        remembered = profiles.get(self.device_id, {}).get('baudrate')
+        self.probe_bps = None
+        restored = False
+        if remembered in BAUD_RATES and remembered != BAUD_RATES[0]:
+            self.baudrate = remembered
+            self._restore_baud()
+            restored = self.baudrate == remembered
+        if not restored or self.baudrate > max_rate:
+            if self.baudrate > max_rate:
+                candidates = [rate for rate in reversed(BAUD_RATES) if rate <= max_rate]
+            else:
+                candidates = [rate for rate in reversed(BAUD_RATES) if self.baudrate < rate <= max_rate]
+            for rate in candidates:
+                if self._try_baud(rate):
+                    break
+        # Only a probe that passed is worth remembering; if every probe failed
+        # the stored rate may still be where the MSP sits.
+        profile = profiles.setdefault(self.device_id, {})
+        if self.probe_bps is not None and profile.get('baudrate') != self.baudrate:
+            profile['baudrate'] = self.baudrate
+            profile['probe_bps'] = self.probe_bps
+            save_device_profiles(profiles)
+        return self.baudrate
+
+    def reset_baud(self):
+        # Leave the MSP at 9600, the rate the next session opens at
+        if self.serial is not None and self.baudrate != BAUD_RATES[0]:
+            self._try_baud(BAUD_RATES[0])
+
+    def link_lost(self, reason):
+        self.reconnect()
+        raise LinkReset(f"{reason}; reconnected to {self.device_id}")
+
+    # -- serial.Serial compatible surface --
+
+    def write(self, data):
+        for attempt in range(2):
+            try:
+                if self.serial is None:
+                    self.reconnect()
+                return self.serial.write(data)
+            except (ser.SerialException, OSError):
+                if attempt:
+                    raise
+                self.reconnect()  # writes are replayed transparently
+
+    def _take(self, size):
+        chunk = bytes(self._rx[:size])
+        del self._rx[:size]
+        return chunk
+
+    def read(self, size=1):
+        head = self._take(size)
+        if len(head) == size:
+            return head
+        try:
+            return head + self.serial.read(size - len(head))
+        except (ser.SerialException, OSError) as e:
+            self.link_lost(f"read failed: {e}")
+
+    def read_until(self, expected=b'\n', size=None):
+        end = self._rx.find(expected)
+        if end >= 0 and (size is None or end + len(expected) <= size):
+            return self._take(end + len(expected))
+        head = self._take(len(self._rx) if size is None else size)
+        if size is not None and len(head) == size:
+            return head
+        try:
+            return head + self.serial.read_until(expected, None if size is None else size - len(head))
+        except (ser.SerialException, OSError) as e:
+            self.link_lost(f"read failed: {e}")
+
+    def read_line(self, timeout=LINE_TIMEOUT):
+        # One '\n'-terminated line; a line that stalls for `timeout` seconds
+        # (None = wait forever) is treated as a dead link.  pyserial's
+        # read_until fetches one byte per call, so instead everything the
+        # driver holds is read at once and split here; what follows the line
+        # stays in _rx for the next read.
+        end = self._rx.find(b'\n')
+        if end >= 0:
+            return self._take(end + 1)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while end < 0:
+            try:
+                chunk = self.serial.read(getattr(self.serial, 'in_waiting', 0) or 1)
+            except (ser.SerialException, OSError) as e:
+                self.link_lost(f"read failed: {e}")
+            if chunk:
+                end = chunk.find(b'\n')
+                if end >= 0:
+                    end += len(self._rx)
+                self._rx += chunk
+                if deadline is not None:
+                    deadline = time.monotonic() + timeout
+            elif deadline is not None and time.monotonic() > deadline:
+                self.link_lost(f"no data for {timeout:g} s")
+        return self._take(end + 1)
+
+    def reset_input_buffer(self):
+        self.serial.reset_input_buffer()
+        self._rx.clear()
+
+    def reset_output_buffer(self):
+        self.serial.reset_output_buffer()
+
 # -----------------------
 # Core I/O and helpers (UNCHANGED FUNCTIONALITY)
 # -----------------------
@@ -32,27 +349,42 @@ def send_angle(angle):
 
 
 def init_uart():
-    global s, inChar
-    s = ser.Serial('COM3', baudrate=9600, bytesize=ser.EIGHTBITS,
-                   parity=ser.PARITY_NONE, stopbits=ser.STOPBITS_ONE,
-                   timeout=1)
-    s.reset_input_buffer()
-    s.reset_output_buffer()
+    global s, inChar, current_device_id
+    s = ConnectionManager(serial_port).open()
+    current_device_id = s.device_id
+    if max_baudrate > BAUD_RATES[0]:
+        s.negotiate_baud(max_baudrate)
     inChar = '0'
 
 
+def close_uart():
+    # Every shutdown path: drop the MSP back to 9600, or the next session
+    # (which opens at 9600) cannot talk to it until a reset
+    if s is None or s.serial is None:
+        return
+    try:
+        s.reset_baud()
+    except (ser.SerialException, OSError):
+        pass
+
+
 def send_data(data_str):
     global s
     for char in data_str:
         _ = len(data_str)
-        send_command(char)
+        send_command(char, menu=False)
     time.sleep(0.05)
     s.write(bytes('$', 'ascii'))
 
 
-def send_command(char):
+def send_command(char, menu=True):
+    # menu=False for payload bytes (angles, lengths) that only look like menu commands
     global s
     s.write(bytes(char, 'ascii', errors='ignore'))
+    if menu and char in MENU_COMMANDS:
+        s.mode, s.resume = char, b''
+    elif menu and char == '0':
+        s.mode, s.resume = None, b''
     time.sleep(0.05)
 
 
@@ -83,42 +415,40 @@ def receive_ack():
 
 
 def receive_data():
-    chr_ = b''
-    while chr_[-1:] != b'\n':
-        chr_ += s.read(1)
-    return chr_.decode('ascii')
+    line = s.read_line(s.line_timeout).decode('ascii')
+    if _sweep_lines is not None:
+        _sweep_lines.append(line)
+    return line
 
 
 def receive_data2():
-    chr_ = b''
-    while chr_[-1:] != b'\n':
-        chr_ += s.read(1)
-    #print(chr_)
-    return chr_
+    return s.read_line(s.line_timeout)
 
 
 def receive_char():
+    # Opcodes come without '\n' and can be minutes apart (255 counts at the
+    # longest set_delay), hence the long idle limit.
     data = b''
     time.sleep(0.25)
+    deadline = time.monotonic() + SCRIPT_OPCODE_TIMEOUT
     while len(data.decode('ascii')) == 0:
         data = s.read_until(expected=b'\n')
+        if not data and time.monotonic() > deadline:
+            s.link_lost(f"no opcode for {SCRIPT_OPCODE_TIMEOUT:g} s")
     return data.decode('ascii')
 
 
 def receive_calib():
     data = b''
     time.sleep(0.25)
+    deadline = time.monotonic() + s.line_timeout
     while len(data.decode('ascii')) == 0:
-        data = s.read_until(terminator=b'\n')
+        data = s.read_until(expected=b'\n')
+        if not data and time.monotonic() > deadline:
+            s.link_lost(f"no calibration data for {s.line_timeout:g} s")
     return data
 
 
-def save_calibration_values(calibration_values):
-    with open('calibration_values.txt', 'w') as file:
-        for value in calibration_values:
-            file.write(str(value) + '\n')
-
-
 def expand_calibration_array(calibration_array, new_length):
     expanded_array = np.zeros(new_length)
     for i in range(new_length):
@@ -132,33 +462,506 @@ def expand_calibration_array(calibration_array, new_length):
     return expanded_array.tolist()
 
 
-def measure_two_ldr_samples():
-    LDR1_val = int(receive_data()) / 292
+def measure_two_ldr_samples(calibration=None):
+    LDR1_val = int(receive_data()) / LDR_SCALE
     time.sleep(0.25)
-    if LDR1_val > 1023 / 292:
+    if LDR1_val > LDR_SWEEP_END / LDR_SCALE:
         return [-1, 0, 0]
-    LDR2_val = int(receive_data()) / 292
-    fitting_index = find_fitting_index(LDR1_val, LDR2_val)
+    LDR2_val = int(receive_data()) / LDR_SCALE
+    fitting_index = find_fitting_index(LDR1_val, LDR2_val, calibration)
     return [fitting_index, LDR1_val, LDR2_val]
 
 
-def find_fitting_index(ldr1_value, ldr2_value):
-    with open('calibration_values_2.txt', 'r') as file:
-        calibration_arr = [float(line.strip()) for line in file]
+def load_calibration_table(path='calibration_values_2.txt'):
+    with open(path, 'r') as file:
+        return np.array([float(line.strip()) for line in file if line.strip()])
+
+
+def lookup_calibration_table():
+    # The device's lookup table (see device_calibration_table), read once per session
+    global calibration_table
+    if calibration_table is None:
+        calibration_table = device_calibration_table(seed=True)
+    return calibration_table
+
+
+def find_fitting_index(ldr1_value, ldr2_value, calibration=None):
+    # `calibration` is a lookup table or a fitted profile (see fit_calibration_profile)
+    if calibration is None:
+        calibration = calibration_profile
+    if isinstance(calibration, dict):
+        return int(profile_fitting_index(calibration, ldr1_value, ldr2_value))
+    if calibration is None:
+        calibration = lookup_calibration_table()
     average_ldr_value = (ldr1_value + ldr2_value) / 2
 
-    # Find closest value
-    min_diff = float("inf")
-    fitting_index = 0
-    for i, val in enumerate(calibration_arr):
-        diff = abs(val - average_ldr_value)
-        if diff < min_diff:
-            min_diff = diff
-            fitting_index = i
+    # Closest value (argmin keeps the first index on ties, like the old loop)
+    fitting_index = int(np.argmin(np.abs(np.asarray(calibration) - average_ldr_value)))
 
     # Return the index (0..49)
     return fitting_index
 
+# -----------------------
+# LDR calibration profiles (fitted models, versioned per device)
+# -----------------------
+
+DEVICE_PROFILES_PATH = 'device_profiles.json'
+CALIBRATION_MODELS = ('inverse_square', 'poly')
+
+current_device_id = 'default'
+calibration_profile = None  # active fitted profile, None -> lookup table
+
+
+def load_device_profiles(path=DEVICE_PROFILES_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_device_profiles(profiles, path=DEVICE_PROFILES_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(profiles, file, indent=1)
+    os.replace(tmp_path, path)
+
+
+def fit_ldr_model(distances, volts, kind='inverse_square', degree=3):
+    # inverse_square: volts = a + b / d^2 (linear least squares in 1/d^2)
+    # poly:           d = polyval(coeffs, volts) (fitted directly in the inverse direction)
+    d = np.asarray(distances, dtype=float)
+    v = np.asarray(volts, dtype=float)
+    if np.unique(d).size < 2:
+        raise ValueError("calibration needs samples from at least two distances")
+    if kind == 'inverse_square':
+        design = np.column_stack([np.ones_like(d), 1.0 / d ** 2])
+        coeffs = np.linalg.lstsq(design, v, rcond=None)[0]
+        residual = v - design @ coeffs
+    elif kind == 'poly':
+        degree = min(degree, np.unique(d).size - 1)
+        coeffs = np.polyfit(v, d, degree)
+        residual = d - np.polyval(coeffs, v)
+    else:
+        raise ValueError(f"unknown calibration model {kind!r}")
+    return {'kind': kind, 'coeffs': [float(c) for c in coeffs],
+            'range': [float(d.min()), float(d.max())],
+            'rms': float(np.sqrt(np.mean(residual ** 2)))}
+
+
+def ldr_model_distance(model, volts):
+    # Closed-form distance [cm] for one or many LDR readings [V].
+    v = np.asarray(volts, dtype=float)
+    if model['kind'] == 'inverse_square':
+        a, b = model['coeffs']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d = np.sqrt(b / (v - a))
+        # readings beyond the asymptote (or on the wrong side of it) are "far"
+        d = np.where(np.isfinite(d), d, model['range'][1])
+    else:
+        d = np.polyval(model['coeffs'], v)
+    return np.clip(d, *model['range'])
+
+
+def calibration_distance(profile, ldr1_value, ldr2_value):
+    return (ldr_model_distance(profile['ldr1'], ldr1_value) +
+            ldr_model_distance(profile['ldr2'], ldr2_value)) / 2
+
+
+def profile_fitting_index(profile, ldr1_value, ldr2_value):
+    # Same 0..49 index space as the lookup table (distance = index + 1)
+    distance = calibration_distance(profile, ldr1_value, ldr2_value)
+    return np.clip(np.rint(distance) - 1, 0, 49).astype(int)
+
+
+class CalibrationSession:
+    # Collects many (distance, LDR1, LDR2) samples before fitting.
+
+    def __init__(self):
+        self.distances = []
+        self.ldr1 = []
+        self.ldr2 = []
+
+    def add(self, distance, ldr1_value, ldr2_value):
+        self.distances.append(float(distance))
+        self.ldr1.append(float(ldr1_value))
+        self.ldr2.append(float(ldr2_value))
+
+    def counts(self):
+        values, counts = np.unique(self.distances, return_counts=True)
+        return dict(zip(values.tolist(), counts.tolist()))
+
+    def fit(self, kind='inverse_square'):
+        return fit_calibration_profile(self.distances, self.ldr1, self.ldr2, kind)
+
+
+def fit_calibration_profile(distances, ldr1_values, ldr2_values, kind='inverse_square'):
+    return {
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'samples': len(distances),
+        'ldr1': fit_ldr_model(distances, ldr1_values, kind),
+        'ldr2': fit_ldr_model(distances, ldr2_values, kind),
+    }
+
+
+def save_calibration_profile(profile, device_id=None, path=DEVICE_PROFILES_PATH):
+    profiles = load_device_profiles(path)
+    history = profiles.setdefault(device_id or current_device_id, {}).setdefault('calibration', [])
+    profile = dict(profile, version=(history[-1]['version'] + 1) if history else 1)
+    history.append(profile)
+    save_device_profiles(profiles, path)
+    return profile
+
+
+def save_calibration_table(table, kind='flash', device_id=None, path=DEVICE_PROFILES_PATH):
+    # kind 'flash': the PB0 table the MSP sends at startup (init_calibrate),
+    # kind 'lookup': the fallback table for devices that sent none
+    profiles = load_device_profiles(path)
+    profiles.setdefault(device_id or current_device_id, {})[kind + '_table'] = [float(v) for v in table]
+    save_device_profiles(profiles, path)
+
+
+def device_calibration_table(device_id=None, path=DEVICE_PROFILES_PATH, seed=False):
+    # The device's PB0 flash table, else its fallback lookup table, else the
+    # legacy calibration_values_2.txt (stored as the fallback when `seed`).
+    entry = load_device_profiles(path).get(device_id or current_device_id, {})
+    for key in ('flash_table', 'lookup_table'):
+        if entry.get(key):
+            return np.array(entry[key])
+    table = load_calibration_table()
+    if seed:
+        save_calibration_table(table, 'lookup', device_id, path)
+    return table
+
+
+def device_calibration(device_id=None, path=DEVICE_PROFILES_PATH):
+    # What the GUI measures with for this device: its fitted profile, else its table
+    profile = active_calibration_profile(device_id, path=path)
+    return profile if profile is not None else device_calibration_table(device_id, path)
+
+
+def active_calibration_profile(device_id=None, version=None, path=DEVICE_PROFILES_PATH):
+    history = load_device_profiles(path).get(device_id or current_device_id, {}).get('calibration', [])
+    if not history:
+        return None
+    if version is None:
+        return history[-1]
+    for profile in history:
+        if profile['version'] == version:
+            return profile
+    raise KeyError(f"calibration version {version} not found")
+
+
+def capture_calibration_sweep(session, distance):
+    # Run one light sweep with the source at `distance` and keep only the
+    # samples where both LDRs face it: the brightest peak of the sweep
+    # (estimate_light_bearings) +-1 step, if they also pass the light test.
+    # Flank and ambient samples read alike too, but not at `distance`.
+    send_command('3')
+    send_command('Y')
+    receive_data()  # angle1
+    receive_data()  # angle2
+    skip = SCAN_MODES['Y'][1]
+    ldr1_arr, ldr2_arr = [], []
+    while True:
+        raw1 = int(receive_data())
+        if raw1 > LDR_SWEEP_END:
+            break
+        ldr1_arr.append(raw1 / LDR_SCALE)
+        ldr2_arr.append(int(receive_data()) / LDR_SCALE)
+    send_command('0')
+    return add_calibration_peak(session, distance, ldr1_arr[skip:], ldr2_arr[skip:])
+
+
+def add_calibration_peak(session, distance, ldr1_arr, ldr2_arr, width=1):
+    lights = estimate_light_bearings(sweep_degrees(len(ldr1_arr)), ldr1_arr, ldr2_arr)
+    if not lights:
+        return 0
+    peak = max(lights, key=lambda light: light['contrast'])['index']
+    captured = 0
+    for ldr1_value, ldr2_value in zip(ldr1_arr[max(peak - width, 0):peak + width + 1],
+                                      ldr2_arr[max(peak - width, 0):peak + width + 1]):
+        if abs(ldr1_value - ldr2_value) < light_epsilon and ldr1_value < 3 and ldr2_value < 3:
+            session.add(distance, ldr1_value, ldr2_value)
+            captured += 1
+    return captured
+
+# -----------------------
+# Sweep classification & replay (shared by the GUI and the headless CLI)
+# -----------------------
+
+def classify_light(ldr_val1, ldr_val2, light_distance, flag, epsilon,
+                   masking_distance=light_masking_distance):
+    # Returns (status, distance to plot, new debounce flag);
+    # status is 'light', 'masked' or 'noise'.
+    if abs(ldr_val1 - ldr_val2) < epsilon and ldr_val1 < 3 and ldr_val2 < 3:
+        if light_distance > int(masking_distance):
+            return 'masked', 0, 0
+        return 'light', (light_distance if flag == 1 else 0), 1
+    return 'noise', 0, 0
+
+
+def estimate_light_bearings(angles, ldr1_values, ldr2_values, min_contrast=0.2, window=3):
+    # Localise light sources within a sweep.  Brightness (lower LDR voltage =
+    # more light) peaks give the coarse position; the LDR1 - LDR2 zero crossing
+    # closest to each peak is linearly interpolated for a sub-step bearing.
+    # Peaks without a nearby crossing fall back to a parabolic vertex fit.
+    # NaN readings (LDR sentinel samples) are ignored.
+    angles = np.asarray(angles, dtype=float)
+    v1 = np.asarray(ldr1_values, dtype=float)
+    v2 = np.asarray(ldr2_values, dtype=float)
+    n = min(angles.size, v1.size, v2.size)
+    if n < 3:
+        return []
+    angles, v1, v2 = angles[:n], v1[:n], v2[:n]
+    steps = np.arange(n, dtype=float)
+
+    valid = np.isfinite(v1) & np.isfinite(v2)
+    if np.count_nonzero(valid) < 3:
+        return []
+    brightness = LDR_SWEEP_END / LDR_SCALE - (v1 + v2) / 2
+    baseline = np.nanmedian(brightness)
+    noise = 1.4826 * np.nanmedian(np.abs(brightness - baseline)) + 1e-3
+    contrast = brightness - baseline
+
+    mid = contrast[1:-1]
+    peaks = np.nonzero((mid >= contrast[:-2]) & (mid > contrast[2:]) & (mid >= min_contrast))[0] + 1
+    if peaks.size == 0:
+        return []
+
+    diff = v1 - v2
+    crossing = np.nonzero((np.signbit(diff[:-1]) != np.signbit(diff[1:])) & valid[:-1] & valid[1:])[0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        frac = diff[crossing] / (diff[crossing] - diff[crossing + 1])
+    cross_pos = crossing + np.nan_to_num(frac, nan=0.5)
+
+    # parabolic vertex of the brightness peak (fallback position)
+    left, centre, right = contrast[peaks - 1], contrast[peaks], contrast[peaks + 1]
+    curvature = left - 2 * centre + right
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(curvature < 0, 0.5 * (left - right) / curvature, 0.0)
+    position = peaks + np.clip(offset, -0.5, 0.5)
+    method = np.full(peaks.size, 'peak', dtype=object)
+
+    if cross_pos.size:
+        nearest = np.clip(np.searchsorted(cross_pos, peaks), 1, cross_pos.size) - 1
+        upper = np.minimum(nearest + 1, cross_pos.size - 1)
+        nearest = np.where(np.abs(cross_pos[upper] - peaks) < np.abs(cross_pos[nearest] - peaks),
+                           upper, nearest)
+        near = np.abs(cross_pos[nearest] - peaks) <= window
+        position = np.where(near, cross_pos[nearest], position)
+        method[near] = 'differential'
+
+    bearings = np.interp(position, steps, angles)
+    confidence = contrast[peaks] / (contrast[peaks] + 3 * noise)
+    return [{'bearing': round(float(b), 2), 'confidence': round(float(c), 3),
+             'index': int(i), 'contrast': round(float(k), 3), 'method': m}
+            for b, c, i, k, m in zip(bearings, confidence, peaks, contrast[peaks], method)]
+
+
+def sweep_degrees(count):
+    if count < 2:  # nothing to spread over the arc
+        return [5.0] * count
+    return [round(float(5) + i * (float(180) - float(0)) / (count - 1), 1)
+            for i in range(count)]
+
+
+def begin_sweep_recording(scan_cmd):
+    global _sweep_lines
+    if sweep_record_dir is not None:
+        _sweep_lines = [f"{scan_cmd} {current_device_id}\n"]  # header: scan command, device
+
+
+def discard_sweep_recording():
+    global _sweep_lines
+    _sweep_lines = None
+
+
+def end_sweep_recording():
+    global _sweep_lines
+    if _sweep_lines is None:
+        return None
+    lines, _sweep_lines = _sweep_lines, None
+    os.makedirs(sweep_record_dir, exist_ok=True)
+    mode = SCAN_MODES[lines[0].split()[0]][0]
+    path = os.path.join(sweep_record_dir,
+                        f"sweep_{mode}_{time.strftime('%Y%m%d_%H%M%S')}_{time.time_ns() % 10**6:06d}.txt")
+    with open(path, 'w') as file:
+        file.writelines(lines)
+    return path
+
+
+def iter_sweep_samples(mode, it):
+    # Consumes sample lines from `it` up to (and including) the terminator, so
+    # it works on a recorded file and on a live link (iter(receive_data, None)).
+    # A truncated recording ends in ValueError, not a bare StopIteration.
+    for line in it:
+        if not line.strip():
+            continue
+        if mode == 'object':
+            distance = int(line)
+            if distance == OBJECT_SWEEP_END:
+                break
+            yield (distance,)
+        elif mode == 'light':
+            raw1 = int(line)
+            if raw1 > LDR_SWEEP_END:
+                break
+            yield (raw1 / LDR_SCALE, int(next(it, '')) / LDR_SCALE)
+        else:
+            distance = int(line)
+            if distance == LIGHT_OBJECT_SWEEP_END:
+                break
+            raw1 = int(next(it, ''))
+            if raw1 > LDR_SWEEP_END:
+                yield (distance, None, None)
+                continue
+            yield (distance, raw1 / LDR_SCALE, int(next(it, '')) / LDR_SCALE)
+    else:
+        raise ValueError("sweep ended before its terminator")
+
+
+def parse_sweep_header(line):
+    # "<scan command> [device id]"; older recordings carry no device id
+    scan_cmd, _, device_id = line.strip().partition(' ')
+    return scan_cmd, device_id or None
+
+
+def parse_sweep(lines):
+    # `lines` is the recorded stream: header, angle1, angle2, samples...
+    it = iter(lines)
+    scan_cmd, device_id = parse_sweep_header(next(it))
+    mode, skip = SCAN_MODES[scan_cmd]
+    angle1 = int(next(it))
+    angle2 = int(next(it))
+    samples = list(iter_sweep_samples(mode, it))
+    return {'mode': mode, 'skip': skip, 'angles': (angle1, angle2), 'samples': samples,
+            'device': device_id}
+
+
+def analyze_sweep(sweep, calibration, max_distance=400):
+    # Mirrors the loops in objects_detector / lights_detector /
+    # light_objects_detector without touching the serial port or Tk.
+    mode = sweep['mode']
+    samples = sweep['samples']
+    if isinstance(samples, SampleBuffer):
+        samples = samples.rows()
+    samples = samples[sweep['skip']:]
+    distance_arr, light_arr = [], []
+    status_counts = {'light': 0, 'masked': 0, 'noise': 0}
+    ldr1_arr, ldr2_arr = [], []
+    flag = 0
+    for sample in samples:
+        if mode == 'object':
+            distance = sample[0]
+            distance_arr.append(distance if distance < max_distance else 0)
+            continue
+        if mode == 'light':
+            ldr_val1, ldr_val2 = sample
+            epsilon = light_epsilon
+        else:
+            distance, ldr_val1, ldr_val2 = sample
+            distance_arr.append(0 if distance > max_distance else distance)
+            epsilon = object_light_epsilon
+        if ldr_val1 is None:  # LDR sentinel, same as measure_two_ldr_samples' [-1, 0, 0]
+            ldr_val1 = ldr_val2 = light_distance = 0
+            ldr1_arr.append(np.nan)  # not a reading: keep it out of the bearings
+            ldr2_arr.append(np.nan)
+        else:
+            light_distance = find_fitting_index(ldr_val1, ldr_val2, calibration) + 1
+            ldr1_arr.append(ldr_val1)
+            ldr2_arr.append(ldr_val2)
+        status, value, flag = classify_light(ldr_val1, ldr_val2, light_distance, flag, epsilon)
+        status_counts[status] += 1
+        (light_arr if mode == 'light_object' else distance_arr).append(value)
+    result = {
+        'mode': mode,
+        'angles': list(sweep['angles']),
+        'distance_arr': distance_arr,
+        'degree_arr': sweep_degrees(len(distance_arr)),
+    }
+    if mode != 'object':
+        result['light_arr'] = light_arr if mode == 'light_object' else distance_arr
+        result['status_counts'] = status_counts
+        bearings = estimate_light_bearings(result['degree_arr'], ldr1_arr, ldr2_arr)
+        for light in bearings:
+            light['distance'] = find_fitting_index(ldr1_arr[light['index']], ldr2_arr[light['index']],
+                                                   calibration) + 1
+        result['bearings'] = bearings
+    return result
+
+
+def _reanalyze_chunk(paths, calibrations, max_distance):
+    # Runs in a worker process; one bad file must not sink the whole chunk.
+    # `calibrations` maps a recorded device id to its calibration, None -> the rest.
+    results = []
+    for path in paths:
+        try:
+            with open(path) as file:
+                sweep = parse_sweep(file.readlines())
+            result = analyze_sweep(sweep, calibrations.get(sweep['device'], calibrations[None]),
+                                   max_distance)
+            result['device'] = sweep['device']
+        except Exception as e:
+            result = {'error': f"{type(e).__name__}: {e}"}
+        result['file'] = path
+        results.append(result)
+    return results
+
+
+def collect_sweep_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '**', 'sweep_*.txt'), recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+
+def sweep_file_device(path):
+    try:
+        with open(path) as file:
+            return parse_sweep_header(file.readline())[1]
+    except (OSError, ValueError):
+        return None
+
+
+def reanalyze(paths, output='reanalysis.json', calibration_path=None,
+              max_distance=400, workers=None, chunk_size=64, device_id=None):
+    # Each sweep is re-analysed with the calibration of the device that
+    # recorded it, unless a table file or a device is forced.  Read-only:
+    # device_profiles.json is never written from here.
+    files = collect_sweep_files(paths)
+    if calibration_path is not None:
+        calibrations = {None: load_calibration_table(calibration_path)}
+    elif device_id is not None:
+        calibrations = {None: device_calibration(device_id)}
+    else:
+        devices = {sweep_file_device(path) for path in files} - {None}
+        calibrations = {device: device_calibration(device) for device in devices}
+        calibrations[None] = device_calibration()
+    chunks = [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_reanalyze_chunk, chunk, calibrations, max_distance)
+                   for chunk in chunks]
+        for future in futures:  # keep input order in the output
+            results.extend(future.result())
+
+    summary = {'files': len(results), 'errors': 0, 'modes': {}, 'lights_detected': 0}
+    for result in results:
+        if 'error' in result:
+            summary['errors'] += 1
+            continue
+        summary['modes'][result['mode']] = summary['modes'].get(result['mode'], 0) + 1
+        summary['lights_detected'] += sum(1 for v in result.get('light_arr', []) if v > 0)
+
+    with open(output, 'w') as file:
+        json.dump({'summary': summary, 'sweeps': results}, file, indent=1)
+    return summary
+
+
 import mplcursors
 
 def draw_scanner_map(distances, angles):
@@ -175,12 +978,12 @@ def draw_scanner_map(distances, angles):
     ax.set_thetamin(0)
     ax.set_thetamax(180)
 
-    max_distance = max(distances) if distances else 50
+    max_distance = int(np.max(distances)) if len(distances) else 50
     if max_distance == 0:
         max_distance = 50
 
     # scatter all points in one artist (black objects)
-    rad_angles = [math.radians(a) for a in angles]
+    rad_angles = np.radians(angles)
     ax.scatter(rad_angles, distances, color="black", s=40, alpha=0.8, edgecolors="k")
 
     # style
@@ -206,7 +1009,7 @@ def draw_scanner_map(distances, angles):
     win.wait_window()
 
 
-def draw_scanner_map_lights(distances, lights, angles):
+def draw_scanner_map_lights(distances, lights, angles, bearings=None):
     win = tk.Toplevel()
     win.title("Scanner Map - Lights")
     win.geometry("950x500")
@@ -220,22 +1023,29 @@ def draw_scanner_map_lights(distances, lights, angles):
     ax.set_thetamin(0)
     ax.set_thetamax(180)
 
-    max_distance = max(distances) if distances else 50
+    max_distance = int(np.max(distances)) if len(distances) else 50
     if max_distance == 0:
         max_distance = 50
 
-    rad_angles = [math.radians(a) for a in angles]
-    colors = ["yellow" if (l > 0 and d < 50) else "black"
-              for d, l in zip(distances, lights)]
-    sizes = [80 if (l > 0 and d < 50) else 30
-             for d, l in zip(distances, lights)]
+    rad_angles = np.radians(angles)
+    is_light = (np.asarray(lights) > 0) & (np.asarray(distances) < 50)
+    colors = np.where(is_light, "yellow", "black")
+    sizes = np.where(is_light, 80, 30)
 
     ax.scatter(rad_angles, distances, c=colors, s=sizes,
                edgecolors="black", alpha=0.85)
 
+    # sub-step light bearings from the LDR differential
+    if bearings:
+        ax.scatter([math.radians(b['bearing']) for b in bearings],
+                   [b['distance'] for b in bearings],
+                   marker="*", c="orange", s=220, edgecolors="black", zorder=3)
+
     # legend with one entry each
     ax.scatter([], [], c="yellow", s=80, edgecolors="black", label="Light Source")
     ax.scatter([], [], c="black", s=30, label="Object")
+    if bearings:
+        ax.scatter([], [], marker="*", c="orange", s=220, edgecolors="black", label="Light Bearing")
     ax.legend(loc="upper right", bbox_to_anchor=(1.2, 1.1))
 
     # style
@@ -260,6 +1070,402 @@ def draw_scanner_map_lights(distances, lights, angles):
     win.grab_set()
     win.wait_window()
 
+# -----------------------
+# Background map rendering (Agg, off the Tk thread)
+# -----------------------
+
+map_export_dir = None            # folder for auto-saved sweep maps, None = no export
+map_export_formats = ('png',)
+
+
+class MapRenderer:
+    # Renders scanner maps on a worker thread with the Agg backend.  One figure
+    # per map kind is built once (polar grid, tick labels, legend) and only the
+    # scatter data and radius labels change per sweep.  Finished PNGs are handed
+    # back to the Tk thread by poll(); snapshots are written to map_export_dir.
+
+    def __init__(self, dpi=80):
+        self.dpi = dpi
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self._figures = {}
+        self._thread = None
+        self._seq = 0
+
+    def submit(self, kind, distances, angles, lights=None, bearings=None, callback=None):
+        # kind: 'objects' or 'lights'; callback(png_bytes, job) runs on the Tk thread
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work, name="map-renderer", daemon=True)
+            self._thread.start()
+        self._seq += 1
+        self.jobs.put({'kind': kind, 'distances': distances, 'angles': angles, 'lights': lights,
+                       'bearings': bearings or [], 'callback': callback, 'seq': self._seq,
+                       'time': time.strftime('%Y%m%d_%H%M%S')})
+
+    def poll(self, widget, interval=100):
+        while True:
+            try:
+                job, png = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if job['callback'] is not None:
+                job['callback'](png, job)
+        widget.after(interval, self.poll, widget, interval)
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                png = self.render(job)
+            except Exception as e:  # keep the worker alive; report through the job
+                job['error'] = f"{type(e).__name__}: {e}"
+                png = None
+            self.results.put((job, png))
+
+    def _figure(self, kind):
+        if kind in self._figures:
+            return self._figures[kind]
+        fig = Figure(figsize=(8, 4), dpi=self.dpi)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111, polar=True)
+        ax.set_theta_zero_location("E")
+        ax.set_theta_direction(1)
+        ax.set_thetamin(0)
+        ax.set_thetamax(180)
+        ax.grid(True, linestyle="--", linewidth=0.6, alpha=0.6)
+        ax.set_facecolor("#f5f5f5")
+        ax.set_xticks([math.radians(a) for a in range(0, 181, 30)])
+        ax.set_xticklabels([f"{a}°" for a in range(0, 181, 30)], fontsize=9)
+        points = ax.scatter([], [], edgecolors="black", alpha=0.85)
+        stars = ax.scatter([], [], marker="*", c="orange", s=220, edgecolors="black", zorder=3)
+        if kind == 'lights':
+            ax.scatter([], [], c="yellow", s=80, edgecolors="black", label="Light Source")
+            ax.scatter([], [], c="black", s=30, label="Object")
+            ax.scatter([], [], marker="*", c="orange", s=220, edgecolors="black", label="Light Bearing")
+            ax.legend(loc="upper right", bbox_to_anchor=(1.2, 1.1))
+        self._figures[kind] = (fig, ax, points, stars, [])
+        return self._figures[kind]
+
+    def render(self, job):
+        fig, ax, points, stars, labels = self._figure(job['kind'])
+        distances = np.asarray(job['distances'])
+        rad_angles = np.radians(np.asarray(job['angles'], dtype=float))
+        if job['kind'] == 'lights':
+            is_light = (np.asarray(job['lights']) > 0) & (distances < 50)
+            points.set_facecolor(np.where(is_light, "yellow", "black"))
+            points.set_sizes(np.where(is_light, 80, 30))
+        else:
+            points.set_facecolor("black")
+            points.set_sizes([40])
+        points.set_offsets(np.column_stack([rad_angles, distances]))
+        bearings = job['bearings']
+        stars.set_offsets(np.array([[math.radians(b['bearing']), b['distance']] for b in bearings])
+                          if bearings else np.empty((0, 2)))
+
+        max_distance = int(distances.max()) if distances.size else 50
+        if max_distance == 0:
+            max_distance = 50
+        ax.set_ylim(0, max_distance * 1.1)
+        for label in labels:
+            label.remove()
+        labels[:] = [ax.text(math.radians(90), radius, f"{int(radius)} cm",
+                             ha="center", va="bottom", fontsize=8)
+                     for radius in ax.get_yticks()[1:]]
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        if map_export_dir is not None:
+            os.makedirs(map_export_dir, exist_ok=True)
+            stem = os.path.join(map_export_dir, f"map_{job['kind']}_{job['time']}_{job['seq']:05d}")
+            for fmt in map_export_formats:
+                if fmt == 'png':
+                    with open(f"{stem}.png", 'wb') as file:
+                        file.write(buffer.getvalue())
+                else:
+                    fig.savefig(f"{stem}.{fmt}", format=fmt)
+        return buffer.getvalue()
+
+
+map_renderer = MapRenderer()
+
+
+class MapViewer:
+    # Non-modal map window.  It is a child of the scan window, so that
+    # window's grab does not lock it, and it is reused for every sweep.
+
+    def __init__(self, master, title):
+        self.master = master
+        self.title = title
+        self.win = None
+        self.photo = None
+        self.last_job = None
+
+    def _build(self):
+        self.win = tk.Toplevel(self.master)
+        self.win.title(self.title)
+        self.label = ttk.Label(self.win)
+        self.label.pack(fill="both", expand=True)
+        self.caption = ttk.Label(self.win, text="")
+        self.caption.pack(pady=(4, 0))
+        btns = ttk.Frame(self.win)
+        btns.pack(pady=6)
+        ttk.Button(btns, text="Interactive", command=self.open_interactive).pack(side="left", padx=4)
+        ttk.Button(btns, text="Close", command=self.win.destroy).pack(side="left", padx=4)
+
+    def show(self, png, job):
+        if not self.master.winfo_exists():  # the scan window closed before the render came back
+            return
+        if png is None:
+            messagebox.showerror("Scanner Map", job.get('error', "rendering failed"), parent=self.master)
+            return
+        if self.win is None or not self.win.winfo_exists():
+            self._build()
+        self.photo = tk.PhotoImage(data=base64.b64encode(png))
+        self.label.config(image=self.photo)
+        self.caption.config(text=f"Sweep #{job['seq']} - {time.strftime('%H:%M:%S')}")
+        self.last_job = job
+
+    def open_interactive(self):
+        job = self.last_job
+        if job['kind'] == 'lights':
+            draw_scanner_map_lights(job['distances'], job['lights'], job['angles'], job['bearings'])
+        else:
+            draw_scanner_map(job['distances'], job['angles'])
+
+# -----------------------
+# Multi-sweep occupancy grid
+# -----------------------
+
+class OccupancyGrid:
+    # Fuses repeated sweeps into a Cartesian grid (x: -range..range, y: 0..range).
+    # `hits` counts, per cell, the sweeps that saw something there; both it and
+    # `sweeps` decay each sweep, so hits / sweeps is ~1 for static clutter and
+    # small for things that just moved in (and fades once they leave).
+    # Scan loops feed it per sample (add_samples at sample_angle) and re-bin
+    # the sweep at its final angles with end_sweep at the terminator.
+
+    def __init__(self, max_range=400, cell_size=5, decay=0.8, static_ratio=0.7):
+        self.max_range = max_range
+        self.cell_size = cell_size
+        self.decay = decay
+        self.static_ratio = static_ratio
+        self.nx = int(math.ceil(2 * max_range / cell_size))
+        self.ny = int(math.ceil(max_range / cell_size))
+        self.reset()
+
+    def reset(self):
+        self.hits = np.zeros((self.ny, self.nx))
+        self.sweeps = 0.0
+        self.last = np.zeros((self.ny, self.nx), dtype=bool)
+        self._current = np.zeros(self.ny * self.nx, dtype=np.int64)
+        self.sweep_samples = 175  # samples in the last sweep (0..180 deg, 1 deg steps, 5 skipped)
+        self.revision = 0         # bumped on every change, for live views
+
+    def sample_angle(self, index):
+        # Provisional angle of the index-th sample of the sweep in progress; the
+        # real ones (sweep_degrees) are only known once the sweep ends.
+        return 5.0 + index * 180.0 / max(self.sweep_samples - 1, 1)
+
+    def add_samples(self, angles, distances):
+        # Incremental update: bin samples into the sweep in progress.
+        rad = np.radians(np.asarray(angles, dtype=float))
+        dist = np.asarray(distances, dtype=float)
+        keep = (dist > 0) & (dist < self.max_range)
+        rad, dist = rad[keep], dist[keep]
+        ix = ((dist * np.cos(rad) + self.max_range) // self.cell_size).astype(np.int64)
+        iy = ((dist * np.sin(rad)) // self.cell_size).astype(np.int64)
+        np.clip(ix, 0, self.nx - 1, out=ix)
+        np.clip(iy, 0, self.ny - 1, out=iy)
+        self._current += np.bincount(iy * self.nx + ix, minlength=self._current.size)
+        self.revision += 1
+
+    def end_sweep(self, angles=None, distances=None):
+        if angles is not None:
+            self._current[:] = 0
+            self.add_samples(angles, distances)
+            self.sweep_samples = len(angles)
+        self.last = (self._current > 0).reshape(self.ny, self.nx)
+        self.hits *= self.decay
+        self.hits += self.last
+        self.sweeps = self.sweeps * self.decay + 1
+        self._current[:] = 0
+        self.revision += 1
+
+    def add_sweep(self, angles, distances):
+        self.end_sweep(angles, distances)
+
+    def occupancy(self):
+        if self.sweeps == 0:
+            return np.zeros_like(self.hits)
+        return self.hits / self.sweeps
+
+    def static_mask(self):
+        return self.occupancy() >= self.static_ratio
+
+    def moving_mask(self):
+        return self.last & ~self.static_mask()
+
+    def current_mask(self):
+        return (self._current > 0).reshape(self.ny, self.nx)
+
+    def extent(self):
+        return (-self.max_range, -self.max_range + self.nx * self.cell_size,
+                0, self.ny * self.cell_size)
+
+    def to_rgba(self):
+        # grey = occupancy, red = seen last sweep but not static,
+        # orange = seen by the sweep in progress but not static
+        occ = self.occupancy()
+        rgba = np.ones((self.ny, self.nx, 4))
+        rgba[..., :3] = (1.0 - occ)[..., None]
+        rgba[self.moving_mask()] = (0.85, 0.1, 0.1, 1.0)
+        rgba[self.current_mask() & ~self.static_mask()] = (1.0, 0.55, 0.0, 1.0)
+        return rgba
+
+    def draw(self, ax):
+        return ax.imshow(self.to_rgba(), origin="lower", extent=self.extent(),
+                         interpolation="nearest", aspect="equal")
+
+
+object_map = OccupancyGrid()
+
+# -----------------------
+# Compact sample storage
+# -----------------------
+
+# 14 packed bytes per sample instead of a Python int/float per value per list
+SAMPLE_DTYPE = np.dtype([
+    ('angle', np.uint16),     # [0.1 deg]
+    ('distance', np.uint16),  # [cm] plotted distance (0 = masked / nothing)
+    ('light', np.uint8),      # [cm] plotted light distance (<= light mask)
+    ('ldr1', np.float32),     # [V]
+    ('ldr2', np.float32),     # [V]
+    ('flags', np.uint8),
+])
+
+SAMPLE_MASKED = 0x01        # object beyond the max distance slider
+SAMPLE_LIGHT = 0x02         # light detected
+SAMPLE_LIGHT_MASKED = 0x04  # light detected but beyond the light mask
+SAMPLE_NOISE = 0x08         # LDR pair failed the epsilon test
+
+LIGHT_STATUS_FLAGS = {'light': SAMPLE_LIGHT, 'masked': SAMPLE_LIGHT_MASKED, 'noise': SAMPLE_NOISE}
+
+
+class SampleBuffer:
+    # Growable structured array; buf['distance'] etc. are zero-copy views of
+    # the filled part, ready for NumPy / matplotlib / np.save.
+    __slots__ = ('mode', '_data', '_size')
+
+    def __init__(self, mode=None, capacity=64):
+        self.mode = mode
+        self._data = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, field):
+        return self._data[field][:self._size]
+
+    def append(self, distance=0, ldr1=0.0, ldr2=0.0, flags=0, light=0, angle=0.0):
+        if self._size == self._data.size:
+            grown = np.zeros(2 * self._data.size, dtype=SAMPLE_DTYPE)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size] = (round(angle * 10), distance, light, ldr1, ldr2, flags)
+        self._size += 1
+
+    def view(self):
+        return self._data[:self._size]
+
+    def degrees(self):
+        return self['angle'] / 10.0
+
+    def set_degrees(self, degrees):
+        self['angle'][:] = np.rint(np.asarray(degrees) * 10)
+
+    def count(self, flag):
+        return int(np.count_nonzero(self['flags'] & flag))
+
+    def rows(self):
+        # Samples as parse_sweep tuples for analyze_sweep; NaN LDRs (sentinel) -> None
+        if self.mode == 'object':
+            return [(d,) for d in self['distance'].tolist()]
+        ldr = [(None, None) if math.isnan(v1) else (v1, v2)
+               for v1, v2 in zip(self['ldr1'].tolist(), self['ldr2'].tolist())]
+        if self.mode == 'light':
+            return ldr
+        return [(d,) + pair for d, pair in zip(self['distance'].tolist(), ldr)]
+
+    def trim(self):
+        # Drop the growth slack once no more samples are coming
+        if self._data.size > max(self._size, 1):
+            self._data = self._data[:max(self._size, 1)].copy()
+        return self
+
+    @property
+    def nbytes(self):
+        # allocated, slack included
+        return self._data.nbytes
+
+    def save(self, path):
+        np.save(path, self.view())
+
+    @classmethod
+    def load(cls, path, mode=None):
+        data = np.load(path)
+        buf = cls(mode, capacity=max(len(data), 1))
+        buf._data[:len(data)] = data
+        buf._size = len(data)
+        return buf
+
+
+sweep_history = []                          # finished sweeps, oldest first
+telemeter_history = SampleBuffer('telemeter')
+OUTPUT_MAX_LINES = 2000                     # Text widgets keep only the recent tail
+
+
+OCCUPANCY_REFRESH_MS = 250
+
+
+def draw_occupancy_map(grid, master=None):
+    # Non-modal and live: redrawn whenever the grid changed, so it can be
+    # watched while sweeps come in (pass the scan window as `master`, its grab
+    # does not lock its children).
+    win = tk.Toplevel(master)
+    win.title("Occupancy Map")
+    win.geometry("950x550")
+
+    fig = plt.figure(figsize=(10, 5))
+    ax = fig.add_subplot(111)
+    image = grid.draw(ax)
+    ax.set_xlabel("x [cm]")
+    ax.set_ylabel("y [cm]")
+    ax.set_title(f"{grid.sweeps:.1f} effective sweeps (red = moving)")
+
+    canvas = FigureCanvasTkAgg(fig, master=win)
+    canvas.draw()
+    canvas.get_tk_widget().pack(fill="both", expand=True)
+
+    shown = {'revision': grid.revision}
+
+    def refresh():
+        if not win.winfo_exists():
+            return
+        if grid.revision != shown['revision']:
+            shown['revision'] = grid.revision
+            image.set_data(grid.to_rgba())
+            ax.set_title(f"{grid.sweeps:.1f} effective sweeps (red = moving)")
+            canvas.draw_idle()
+        win.after(OCCUPANCY_REFRESH_MS, refresh)
+
+    btns = ttk.Frame(win)
+    btns.pack(pady=6)
+    ttk.Button(btns, text="Clear", command=grid.reset).pack(side="left", padx=4)
+    ttk.Button(btns, text="Close", command=win.destroy).pack(side="left", padx=4)
+    win.after(OCCUPANCY_REFRESH_MS, refresh)
+    return win
+
 # -----------------------
 # Plot windows (Tkinter)
 # -----------------------
@@ -285,6 +1491,71 @@ def _make_output(parent) -> tk.Text:
     return out
 
 
+def _trim_output(out, max_lines=OUTPUT_MAX_LINES):
+    extra = int(out.index("end-1c").split(".")[0]) - max_lines
+    if extra > 0:
+        out.delete("1.0", f"{extra + 1}.0")
+
+
+def _finish_sweep(out, samples):
+    # The samples live in the SampleBuffer; the log only gets a summary line.
+    sweep_history.append(samples.trim())
+    degrees = samples.degrees()
+    summary = f"Sweep: {len(samples)} samples"
+    if len(samples):
+        summary += f" over {degrees[0]:.0f}-{degrees[-1]:.0f}°"
+    if samples.count(SAMPLE_MASKED):
+        summary += f", {samples.count(SAMPLE_MASKED)} masked"
+    if samples.mode != 'object':
+        summary += f", {samples.count(SAMPLE_LIGHT)} light hits"
+    out.insert("end", summary + "\n")
+    _trim_output(out)
+    out.see("end")
+
+
+def _link_guarded(out, *buttons):
+    # Wrap a blocking scan handler: if the link resets mid-run, or is lost
+    # for good (reconnect gave up), report it and hand the controls back
+    # instead of leaving the window stuck.
+    def wrap(handler):
+        def run(*args):
+            try:
+                return handler(*args)
+            except LinkReset as e:
+                discard_sweep_recording()
+                out.insert("end", f"Connection reset ({e}) - run aborted, press Start again\n", "red_text")
+                out.see("end")
+                for button in buttons:
+                    button.config(state="normal")
+            except ser.SerialException as e:
+                discard_sweep_recording()
+                out.insert("end", f"Link lost ({e}) - reconnect the MSP and press Start again\n", "red_text")
+                out.see("end")
+                for button in buttons:
+                    button.config(state="normal")
+        return run
+    return wrap
+
+
+def _back_to_menu(win):
+    # Back has to close the window even when the link is gone for good
+    try:
+        send_command('0')
+    except ser.SerialException:
+        pass
+    win.destroy()
+
+
+def _report_bearings(out, degree_arr, ldr1_arr, ldr2_arr):
+    bearings = estimate_light_bearings(degree_arr, ldr1_arr, ldr2_arr)
+    for light in bearings:
+        i = light['index']
+        light['distance'] = find_fitting_index(ldr1_arr[i], ldr2_arr[i]) + 1
+        out.insert("end", f"Light source at {light['bearing']:.1f}° | ~{light['distance']} [cm]"
+                          f" | confidence {light['confidence']:.2f} ({light['method']})\n", "blue_text")
+    return bearings
+
+
 # -----------------------
 # Main Functions
 # -----------------------
@@ -300,41 +1571,47 @@ def objects_detector():
     slider.grid(row=0, column=1, sticky="we", padx=6)
 
     out = _make_output(root)
+    viewer = MapViewer(win, "Scanner Map")
 
     btn_scan = ttk.Button(root, text="Start Scan", style="Action.TButton")
     btn_back = ttk.Button(root, text="Back", style="Action.TButton")
+    btn_map = ttk.Button(root, text="Occupancy Map", style="Action.TButton",
+                         command=lambda: draw_occupancy_map(object_map, win))
     btn_scan.grid(row=1, column=0, pady=6, sticky="w")
     btn_back.grid(row=1, column=1, pady=6, sticky="w")
+    btn_map.grid(row=1, column=2, pady=6, sticky="w")
 
     def scan():
         btn_scan.config(state="disabled")
         btn_back.config(state="disabled")
-        distance_arr = []
+        samples = SampleBuffer('object')
         # max_distance = dist_var.get()
         send_command('U')
+        begin_sweep_recording('U')
         angle1 = int(receive_data())
         angle2 = int(receive_data())
         counter = 0
         while True:
             win.update()
             distance = int(receive_data())
-            if distance == 500:
+            if distance == OBJECT_SWEEP_END:
                 break
             current_max = max_dist_var.get()
             if counter > 4:
                 if distance < int(current_max):
-                    distance_arr.append(distance)
+                    samples.append(distance)
                     out.insert("end", f"Distance: {distance:>3} [cm]\n")
                 else:
                     out.insert("end", f"Distance: {distance:>3} [cm]")
                     out.insert("end", " - MASKED\n", "red_text")
-                    distance_arr.append(0)
+                    samples.append(0, flags=SAMPLE_MASKED)
+                object_map.add_samples([object_map.sample_angle(len(samples) - 1)], samples['distance'][-1:])
             counter += 1
-        degree_arr = [round(float(5) + i * (float(180) - float(0)) / (len(distance_arr) - 1), 1)
-                      for i in range(len(distance_arr))]
-        out.insert("end", f"Distance array: {distance_arr}\n")
-        out.insert("end", f"Degree array: {degree_arr}\n")
-        draw_scanner_map(distance_arr, degree_arr)
+        end_sweep_recording()
+        samples.set_degrees(sweep_degrees(len(samples)))
+        _finish_sweep(out, samples)
+        object_map.end_sweep(samples.degrees(), samples['distance'])
+        map_renderer.submit('objects', samples['distance'], samples.degrees(), callback=viewer.show)
         btn_scan.config(state="normal")
         btn_back.config(state="normal")
 
@@ -342,8 +1619,8 @@ def objects_detector():
     #     send_command('0')
     #     win.destroy()
 
-    btn_scan.config(command=scan)
-    btn_back.config(command=lambda: (send_command('0'), win.destroy()))
+    btn_scan.config(command=_link_guarded(out, btn_scan, btn_back)(scan))
+    btn_back.config(command=lambda: _back_to_menu(win))
 
     win.grab_set(); win.wait_window()
 
@@ -369,9 +1646,28 @@ def telemeter():
 
     def poll():
         if dynamic_flag["val"]:
-            distance = int(receive_data())
-            angle = int(receive_data())
+            try:
+                distance = int(receive_data())
+                angle = int(receive_data())
+            except LinkReset as e:
+                # the manager already re-entered telemeter mode at the same angle
+                out.insert("end", f"Connection reset ({e}) - resumed\n", "red_text")
+                win.after(100, poll)
+                return
+            except ser.SerialException as e:
+                # reconnect gave up: stop polling and hand the controls back
+                dynamic_flag["val"] = 0
+                s.resume = b''
+                telemeter_history.trim()
+                out.insert("end", f"Link lost ({e}) - reconnect the MSP and press Start again\n", "red_text")
+                out.see("end")
+                btn_stop.config(state="disabled")
+                btn_start.config(state="normal")
+                btn_back.config(state="normal")
+                return
+            telemeter_history.append(distance, angle=angle)
             out.insert("end", f"Distance: {distance:>3} [cm]\n")
+            _trim_output(out)
             out.see("end")
             win.after(100, poll)
 
@@ -389,6 +1685,7 @@ def telemeter():
             return
         dynamic_flag["val"] = 1
         send_angle(angle)
+        s.resume = b'V' + str(angle).rjust(3, '0').encode('ascii') + b'$'
         poll()
 
     def stop():
@@ -396,7 +1693,9 @@ def telemeter():
         btn_start.config(state="normal")
         btn_back.config(state="normal")
         send_command('W')
+        s.resume = b''
         dynamic_flag["val"] = 0
+        telemeter_history.trim()
 
     # def back():
     #     send_command('0')
@@ -404,7 +1703,7 @@ def telemeter():
 
     btn_start.config(command=start)
     btn_stop.config(command=stop)
-    btn_back.config(command=lambda: (send_command('0'), win.destroy()))
+    btn_back.config(command=lambda: _back_to_menu(win))
 
     win.grab_set(); win.wait_window()
 
@@ -425,13 +1724,14 @@ def lights_detector():
     out_lbl.grid(row=2, column=0, columnspan=3, sticky="w")
 
     out = _make_output(root)
+    viewer = MapViewer(win, "Scanner Map - Lights")
 
     def scan():
         btn_back.config(state="disabled")
         btn_scan.config(state="disabled")
-        distance_arr = []
-        masking_distance = 50
+        samples = SampleBuffer('light')
         send_command('Y')
+        begin_sweep_recording('Y')
         angle1 = int(receive_data())
         angle2 = int(receive_data())
         counter = 0
@@ -449,33 +1749,26 @@ def lights_detector():
                 LDR2_val_trunc = f"{ldr_val2:.2f}"
                 out.insert("end", f"Left LDR value: {LDR1_val_trunc} [V] | Right LDR value: {LDR2_val_trunc} [V]")
                 out.insert("end", f" | Estimate Distance: {light_distance} [cm]")
-                if abs(ldr_val1 - ldr_val2) < light_epsilon and ldr_val1 < 3 and ldr_val2 < 3:
-                    if light_distance > int(masking_distance):
-                        out.insert("end", " (MASKED) \n", "red_text")
-                        distance_arr.append(0)
-                        flag = 0
-                    else:
-                        out.insert("end", " - LIGHT DETECTED \n", "green_text")
-                        if flag == 1:
-                            distance_arr.append(light_distance)
-                        else:
-                            distance_arr.append(0)
-                        flag = 1
+                status, value, flag = classify_light(ldr_val1, ldr_val2, light_distance, flag, light_epsilon)
+                if status == 'masked':
+                    out.insert("end", " (MASKED) \n", "red_text")
+                elif status == 'light':
+                    out.insert("end", " - LIGHT DETECTED \n", "green_text")
                 else:
-                    flag = 0
                     out.insert("end", " (NOISE) \n", "red_text")
-                    distance_arr.append(0)
+                samples.append(value, ldr_val1, ldr_val2, LIGHT_STATUS_FLAGS[status], light=value)
             counter += 1
-        degree_arr = [round(float(5) + i * (float(180) - float(0)) / (len(distance_arr) - 1), 1)
-                      for i in range(len(distance_arr))]
-        out.insert("end", f"Distance array: {distance_arr}\n")
-        out.insert("end", f"Degree array: {degree_arr}\n")
-        draw_scanner_map_lights(distance_arr, distance_arr, degree_arr)
+        end_sweep_recording()
+        samples.set_degrees(sweep_degrees(len(samples)))
+        _finish_sweep(out, samples)
+        bearings = _report_bearings(out, samples.degrees(), samples['ldr1'], samples['ldr2'])
+        map_renderer.submit('lights', samples['distance'], samples.degrees(), samples['light'], bearings,
+                            callback=viewer.show)
         btn_back.config(state="normal")
         btn_scan.config(state="normal")
 
-    btn_scan.config(command=scan)
-    btn_back.config(command=lambda: (send_command('0'), win.destroy()))
+    btn_scan.config(command=_link_guarded(out, btn_scan, btn_back)(scan))
+    btn_back.config(command=lambda: _back_to_menu(win))
 
     win.grab_set(); win.wait_window()
 
@@ -497,15 +1790,15 @@ def light_objects_detector():
     btn_back.grid(row=2, column=1, pady=6, sticky="w")
 
     out = _make_output(root)
+    viewer = MapViewer(win, "Scanner Map - Lights")
 
     def scan():
         btn_go.config(state="disabled")
         btn_back.config(state="disabled")
-        distance_arr = []
-        light_arr = []
+        samples = SampleBuffer('light_object')
         # masking_distance_objects = dist_var.get()
-        masking_distance_lights = 50
         send_command('Z')
+        begin_sweep_recording('Z')
         angle1 = int(receive_data())
         angle2 = int(receive_data())
         counter = 0
@@ -513,7 +1806,7 @@ def light_objects_detector():
         while True:
             win.update()
             distance = int(receive_data())
-            if distance == 9999:
+            if distance == LIGHT_OBJECT_SWEEP_END:
                 break
             arr = measure_two_ldr_samples()
             current_max = max_dist_var.get()
@@ -521,43 +1814,42 @@ def light_objects_detector():
                 light_distance = arr[0] + 1
                 ldr_val1 = arr[1]
                 ldr_val2 = arr[2]
+                object_flags = 0
                 if distance > int(current_max):
                     out.insert("end", f"Measured Distance: {distance} [cm]")
                     out.insert("end", " (MASKED) ", "red_text")
-                    distance_arr.append(0)
+                    distance, object_flags = 0, SAMPLE_MASKED
                 else:
                     out.insert("end", f"Measured Distance: {distance} [cm]")
-                    distance_arr.append(distance)
                 out.insert("end", f" | Estimate Light Distance: {light_distance} [cm]")
-                if abs(ldr_val1 - ldr_val2) < object_light_epsilon and ldr_val1 < 3 and ldr_val2 < 3:
+                status, value, flag = classify_light(ldr_val1, ldr_val2, light_distance, flag,
+                                                     object_light_epsilon)
+                if status == 'noise':
+                    out.insert("end", " (NOISE) \n", "red_text")
+                else:
                     out.insert("end", " - LIGHT DETECTED", "green_text")
-                    if light_distance > int(masking_distance_lights):
-                        light_arr.append(0)
-                        flag = 0
+                    if status == 'masked':
                         out.insert("end", " (MASKED) \n", "red_text")
                     else:
-                        if flag == 1:
-                            light_arr.append(light_distance)
-                        else:
-                            light_arr.append(0)
                         out.insert("end", "\n")
-                        flag = 1
-                else:
-                    out.insert("end", " (NOISE) \n", "red_text")
-                    flag = 0
-                    light_arr.append(0)
+                if arr[0] == -1:  # LDR sentinel: no reading, keep it out of the bearings
+                    ldr_val1 = ldr_val2 = np.nan
+                samples.append(distance, ldr_val1, ldr_val2, object_flags | LIGHT_STATUS_FLAGS[status],
+                               light=value)
+                object_map.add_samples([object_map.sample_angle(len(samples) - 1)], [distance])
             counter += 1
-        degree_arr = [round(float(5) + i * (float(180) - float(0)) / (len(distance_arr) - 1), 1)
-                      for i in range(len(distance_arr))]
-        out.insert("end", f"Distance array: {distance_arr}\n")
-        out.insert("end", f"Lights array: {light_arr}\n")
-        out.insert("end", f"Degree array: {degree_arr}\n")
-        draw_scanner_map_lights(distance_arr, light_arr, degree_arr)
+        end_sweep_recording()
+        samples.set_degrees(sweep_degrees(len(samples)))
+        _finish_sweep(out, samples)
+        object_map.end_sweep(samples.degrees(), samples['distance'])
+        bearings = _report_bearings(out, samples.degrees(), samples['ldr1'], samples['ldr2'])
+        map_renderer.submit('lights', samples['distance'], samples.degrees(), samples['light'], bearings,
+                            callback=viewer.show)
         btn_go.config(state="normal")
         btn_back.config(state="normal")
 
-    btn_go.config(command=scan)
-    btn_back.config(command=lambda: (send_command('0'), win.destroy()))
+    btn_go.config(command=_link_guarded(out, btn_go, btn_back)(scan))
+    btn_back.config(command=lambda: _back_to_menu(win))
 
     win.grab_set(); win.wait_window()
 
@@ -599,7 +1891,7 @@ def file_mode():
     btn_pb1.grid( row=13, column=1, pady=(10,5), sticky="ew")
     # Back button (full width at bottom of left section)
     btn_back = ttk.Button(root, text="Back", style="Action.TButton",
-                          command=lambda: (send_command('0'), win.destroy()))
+                          command=lambda: _back_to_menu(win))
     btn_back.grid(row=13, column=0, pady=(10, 5), sticky="ew")
 
     # Make columns 0..2 uniform; give column 3 (output) extra weight
@@ -659,11 +1951,11 @@ def file_mode():
             # send file date
             #command = str(len(string).to_bytes(1, 'big'))[2]
             command = chr(len(string))
-            send_command(command)
+            send_command(command, menu=False)
             send_data(string)
             # send file name
             command = chr(len(file_name))
-            send_command(command)
+            send_command(command, menu=False)
             send_data(file_name)
             receive_ack()
         button_refs[index][0].config(state="disabled")
@@ -700,23 +1992,18 @@ def file_mode():
                 out.see("end")
 
             elif opcode == '7':
-                distance_arr = []
+                samples = SampleBuffer('object')
                 angle1 = int(receive_data())
                 angle2 = int(receive_data())
                 while True:
                     win.update()
                     distance = int(receive_data())
-                    if distance == 500:
+                    if distance == OBJECT_SWEEP_END:
                         break
-                    distance_arr.append(distance)
-                degree_arr = [
-                    round(float(angle1) + i * (float(angle2) - float(angle1)) / (len(distance_arr) - 1), 1)
-                    for i in range(len(distance_arr))
-                ]
-                out.insert("end", f"Distance array: {distance_arr}\n")
-                out.insert("end", f"Degree array: {degree_arr}\n")
-                out.see("end")
-                #draw_scanner_map(distance_arr, degree_arr)
+                    samples.append(distance)
+                samples.set_degrees(np.linspace(angle1, angle2, len(samples)))
+                _finish_sweep(out, samples)
+                #draw_scanner_map(samples['distance'], samples.degrees())
 
             elif opcode == '8':
                 break
@@ -730,7 +2017,7 @@ def file_mode():
     for i, button in enumerate(button_refs):
         button[0].config(command=lambda v=i: do_upload(v, slot=attach_dict[v][0], file_flag=True))
         button[1].config(command=lambda v=i: do_upload(v, slot=attach_dict[v][0], file_flag=False))
-        button[2].config(command=lambda v=i: do_play(attach_dict[v][1], f"Playing {v+1}"))
+        button[2].config(command=lambda v=i: _link_guarded(out)(do_play)(attach_dict[v][1], f"Playing {v+1}"))
 
     def update_status():
         global ACK
@@ -769,7 +2056,53 @@ def light_calibrate():
     out_lbl = ttk.Label(root, text=" ")
     out_lbl.grid(row=2, column=0, columnspan=3, sticky="w")
 
+    # Automatic calibration: several sweeps per known distance, then a model fit
+    auto = ttk.LabelFrame(root, text="Automatic calibration", padding=6)
+    auto.grid(row=3, column=0, columnspan=3, sticky="ew", pady=6)
+    ttk.Label(auto, text="Light distance (cm):").grid(row=0, column=0, sticky="w")
+    dist_var = tk.StringVar(value="10")
+    ttk.Entry(auto, textvariable=dist_var, width=8).grid(row=0, column=1, sticky="w", padx=4)
+    ttk.Label(auto, text="Model:").grid(row=0, column=2, sticky="w")
+    model_var = tk.StringVar(value=CALIBRATION_MODELS[0])
+    ttk.Combobox(auto, textvariable=model_var, values=CALIBRATION_MODELS, width=14,
+                 state="readonly").grid(row=0, column=3, sticky="w", padx=4)
+    btn_capture = ttk.Button(auto, text="Capture Sweep")
+    btn_fit = ttk.Button(auto, text="Fit & Save")
+    btn_capture.grid(row=1, column=0, columnspan=2, pady=4, sticky="w")
+    btn_fit.grid(row=1, column=2, columnspan=2, pady=4, sticky="w")
+
     out = _make_output(root)
+    session = CalibrationSession()
+
+    def capture():
+        try:
+            distance = float(dist_var.get())
+        except ValueError:
+            messagebox.showerror("Invalid distance", "Enter the light distance in cm")
+            return
+        btn_capture.config(state="disabled")
+        win.update()
+        captured = capture_calibration_sweep(session, distance)
+        out.insert("end", f"{distance:g} cm: {captured} samples captured\n")
+        out.insert("end", f"Samples per distance: {session.counts()}\n")
+        out.see("end")
+        btn_capture.config(state="normal")
+
+    def fit_and_save():
+        global calibration_profile
+        try:
+            profile = save_calibration_profile(session.fit(model_var.get()))
+        except (ValueError, np.linalg.LinAlgError) as e:
+            messagebox.showerror("Calibration", str(e))
+            return
+        calibration_profile = profile
+        out.insert("end", f"Saved calibration v{profile['version']} for {current_device_id} "
+                          f"(rms LDR1 {profile['ldr1']['rms']:.3f}, LDR2 {profile['ldr2']['rms']:.3f})\n",
+                   "green_text")
+        out.see("end")
+
+    btn_capture.config(command=_link_guarded(out, btn_capture)(capture))
+    btn_fit.config(command=fit_and_save)
 
     # def calibrate():
     #     LDR_calibrate_arr = []
@@ -784,26 +2117,28 @@ def light_calibrate():
 
     # btn_cal.config(command=calibrate)
     btn_cal.config(command=lambda: (send_command('X'), win.destroy()))
-    btn_back.config(command=lambda: (send_command('0'), win.destroy()))
+    btn_back.config(command=lambda: _back_to_menu(win))
 
     win.grab_set(); win.wait_window()
 
 
 def init_calibrate():
+    global calibration_table
     send_command('6')
     msp_calib_arr = []
     ldr_val = receive_data2()
     for i in ldr_val:
         msp_calib_arr.append((4 * i) / 292.0)
     flash_expanded = expand_calibration_array(msp_calib_arr, 50)
-    save_calibration_values(flash_expanded)
+    save_calibration_table(flash_expanded, 'flash')
+    calibration_table = np.array(flash_expanded)
 
 # -----------------------
 # Main Window (Tkinter)
 # -----------------------
 
 def main():
-    global s
+    global s, calibration_profile
 
     root = tk.Tk()
     style = ttk.Style(root)
@@ -811,6 +2146,7 @@ def main():
     style.configure("Action.TButton", font=("Segoe UI", 13), padding=(16, 12))
     root.title("DCS Final Project - Omer Pintel & Romi Lustig")
     root.geometry("980x640")
+    map_renderer.poll(root)
 
     # Top bar
     top = ttk.Frame(root, padding=(10,8))
@@ -862,35 +2198,386 @@ def main():
 
 
     def on_exit():
+        close_uart()
         try:
             send_command('q')
         except Exception:
             pass
         root.destroy()
 
+    root.protocol("WM_DELETE_WINDOW", on_exit)
+
     ttk.Button(nav, text="Exit", width=28, style="Nav.TButton",
                command=on_exit).pack(anchor="w", pady=(12, 0))
     # Perform the same startup handshake (unchanged behavior)
     try:
         init_uart()
         init_calibrate()
-        status_var.set("Connected to MSP")
+        calibration_profile = active_calibration_profile()
+        if calibration_profile is None:
+            lookup_calibration_table()
+        status = f"Connected to MSP @ {s.baudrate} baud"
+        if calibration_profile is not None:
+            status += f" (calibration v{calibration_profile['version']})"
+        status_var.set(status)
     except Exception as e:
         status_var.set(f"Startup issue: {e}")
         messagebox.showerror("Startup", f"Startup Failed.\n\n{e}")
 
     root.mainloop()
 
+# -----------------------
+# Headless scan service (REST + WebSocket, needs aiohttp)
+# -----------------------
+
+# mode -> (menu command, scan command)
+SERVICE_MODES = {
+    'object': ('1', 'U'),
+    'telemeter': ('2', 'V'),
+    'light': ('3', 'Y'),
+    'light_object': ('4', 'Z'),
+}
+
+
+class ReplaySerial:
+    # Serial stand-in that answers scan commands with recorded sweeps, so the
+    # service (and anything else on top of ConnectionManager) can run without
+    # hardware.  Telemeter mode streams the object sweeps' distances.
+
+    def __init__(self, sweep_files, line_delay=0.0):
+        self.sweeps = {}
+        self.skipped = []  # (path, error) of files that are not complete sweeps
+        for path in collect_sweep_files(sweep_files):
+            try:
+                with open(path) as file:
+                    lines = file.readlines()
+                parse_sweep(lines)  # empty / truncated / garbled files never reach a client
+            except Exception as e:
+                self.skipped.append((path, f"{type(e).__name__}: {e}"))
+                continue
+            self.sweeps.setdefault(parse_sweep_header(lines[0])[0], deque()).append(lines[1:])
+        self.line_delay = line_delay
+        self.baudrate = BAUD_RATES[0]
+        self._pending = deque()
+        self._telemeter = None
+        self._angle = b''
+
+    def _queue_sweep(self, scan_cmd):
+        recorded = self.sweeps.get(scan_cmd)
+        if recorded:
+            recorded.rotate(-1)
+            self._pending.extend(line.encode('ascii') for line in recorded[0])
+
+    def write(self, data):
+        for byte in bytes(data):
+            char = chr(byte)
+            if self._telemeter is not None and len(self._angle) < 3:
+                self._angle += bytes([byte])
+                if len(self._angle) == 3:
+                    self._telemeter = int(self._angle)
+            elif char in 'UYZ':
+                self._queue_sweep(char)
+            elif char == 'V':
+                self._telemeter, self._angle = 0, b''
+            elif char in 'W0':
+                self._telemeter = None
+                if char == '0':
+                    self._pending.clear()
+        return len(data)
+
+    def _next_line(self):
+        if not self._pending and self._telemeter is not None and len(self._angle) == 3:
+            for sweep in self.sweeps.get('U', ()):
+                for line in sweep[2:-1]:
+                    self._pending.append(line.encode('ascii'))
+                    self._pending.append(b'%03d\n' % self._telemeter)
+                break
+        if not self._pending:
+            return b''
+        if self.line_delay:
+            time.sleep(self.line_delay)
+        return self._pending.popleft()
+
+    @property
+    def in_waiting(self):
+        return len(self._pending[0]) if self._pending else 0
+
+    def read_until(self, expected=b'\n', size=None):
+        return self._next_line()
+
+    def read(self, size=1):
+        if self._pending and len(self._pending[0]) > size:
+            head = self._pending[0]
+            self._pending[0] = head[size:]
+            return head[:size]
+        return self._next_line()
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def iter_scan(mode, stop, max_distance=400, angle=90, continuous=False, calibration=None):
+    # Drive one scan mode over the live link `s` and yield JSON-able frames:
+    # a 'sample' per measurement and a 'sweep' (analyze_sweep result) per sweep.
+    # `stop()` is checked per sample in telemeter mode, per sweep otherwise.
+    menu_cmd, scan_cmd = SERVICE_MODES[mode]
+    send_command(menu_cmd)
+    try:
+        if mode == 'telemeter':
+            send_command(scan_cmd)
+            send_angle(angle)
+            s.resume = b'V' + str(angle).rjust(3, '0').encode('ascii') + b'$'
+            while not stop():
+                distance = int(receive_data())
+                yield {'type': 'sample', 'mode': mode, 'distance': distance,
+                       'angle': int(receive_data())}
+            send_command('W')
+            return
+
+        line_source = iter(receive_data, None)
+        scan_mode, skip = SCAN_MODES[scan_cmd]
+        while True:
+            send_command(scan_cmd)
+            angles = (int(receive_data()), int(receive_data()))
+            samples = SampleBuffer(scan_mode)
+            for sample in iter_sweep_samples(scan_mode, line_source):
+                frame = {'type': 'sample', 'mode': mode, 'index': len(samples)}
+                if mode == 'object':
+                    frame['distance'] = sample[0]
+                    samples.append(sample[0])
+                elif mode == 'light':
+                    frame['ldr1'], frame['ldr2'] = sample
+                    samples.append(0, *sample)
+                else:
+                    frame['distance'], frame['ldr1'], frame['ldr2'] = sample
+                    samples.append(sample[0], *(np.nan if v is None else v for v in sample[1:]))
+                if 'distance' in frame and len(samples) > skip:
+                    distance = frame['distance'] if frame['distance'] < max_distance else 0
+                    object_map.add_samples([object_map.sample_angle(len(samples) - 1 - skip)], [distance])
+                yield frame
+            sweep = {'mode': scan_mode, 'skip': skip, 'angles': angles, 'samples': samples}
+            result = analyze_sweep(sweep, calibration, max_distance)
+            if scan_mode != 'light':
+                object_map.end_sweep(result['degree_arr'], result['distance_arr'])
+            yield dict(result, type='sweep')
+            if not continuous or stop():
+                return
+    finally:
+        send_command('0')
+
+
+class ScanService:
+    # One serial reader (a worker thread running iter_scan) fanned out to any
+    # number of clients.  Each client has a bounded queue; when a client falls
+    # behind its oldest frames are dropped, the device is never blocked.
+
+    def __init__(self, queue_size=256):
+        self.queue_size = queue_size
+        self.clients = set()
+        self.mode = None
+        self.dropped = 0
+        self.frames = 0
+        self.calibration = None
+        self._task = None
+        self._stop = threading.Event()
+        self._lock = asyncio.Lock()
+
+    def subscribe(self):
+        frames = asyncio.Queue(maxsize=self.queue_size)
+        self.clients.add(frames)
+        return frames
+
+    def unsubscribe(self, frames):
+        self.clients.discard(frames)
+
+    def publish(self, frame):
+        self.frames += 1
+        for frames in self.clients:
+            if frames.full():
+                frames.get_nowait()
+                self.dropped += 1
+            frames.put_nowait(frame)
+
+    def status(self):
+        return {'type': 'status', 'mode': self.mode, 'clients': len(self.clients),
+                'frames': self.frames, 'dropped': self.dropped,
+                'device': getattr(s, 'device_id', None), 'baudrate': getattr(s, 'baudrate', None)}
+
+    async def start(self, mode, **params):
+        if mode not in SERVICE_MODES:
+            raise KeyError(mode)
+        async with self._lock:
+            if self._task is not None and not self._task.done():
+                raise RuntimeError(f"{self.mode} scan already running")
+            self._stop.clear()
+            self.mode = mode
+            self._task = asyncio.create_task(self._run(mode, params))
+            self.publish(self.status())
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            await self._task
+
+    async def _run(self, mode, params):
+        loop = asyncio.get_running_loop()
+
+        def pump():
+            for frame in iter_scan(mode, self._stop.is_set, calibration=self.calibration, **params):
+                loop.call_soon_threadsafe(self.publish, frame)
+
+        try:
+            await loop.run_in_executor(None, pump)
+        except Exception as e:  # any worker failure ends the scan, not the request that stops it
+            self.publish({'type': 'error', 'mode': mode, 'error': f"{type(e).__name__}: {e}"})
+        finally:
+            self.mode = None
+            self.publish(self.status())
+
+
+def make_service_app(service):
+    from aiohttp import web, WSMsgType
+
+    async def get_status(request):
+        return web.json_response(service.status())
+
+    async def start_scan(request):
+        try:
+            params = await request.json() if request.can_read_body else {}
+        except ValueError:
+            raise web.HTTPBadRequest(text="request body must be a JSON object")
+        if not isinstance(params, dict):
+            raise web.HTTPBadRequest(text="request body must be a JSON object")
+        allowed = {'max_distance', 'angle', 'continuous'}
+        try:
+            await service.start(request.match_info['mode'],
+                                **{k: v for k, v in params.items() if k in allowed})
+        except KeyError:
+            raise web.HTTPNotFound(text=f"unknown mode {request.match_info['mode']!r}")
+        except RuntimeError as e:
+            raise web.HTTPConflict(text=str(e))
+        return web.json_response(service.status())
+
+    async def stop_scan(request):
+        await service.stop()
+        return web.json_response(service.status())
+
+    async def websocket(request):
+        ws = web.WebSocketResponse(heartbeat=20)
+        await ws.prepare(request)
+        frames = service.subscribe()
+
+        async def sender():
+            while True:
+                await ws.send_json(await frames.get())
+
+        send_task = asyncio.create_task(sender())
+        try:
+            await ws.send_json(service.status())
+            async for msg in ws:  # clients only talk through REST; drain pings/close
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            send_task.cancel()
+            service.unsubscribe(frames)
+        return ws
+
+    async def on_shutdown(app):
+        await service.stop()
+
+    app = web.Application()
+    app.add_routes([
+        web.get('/status', get_status),
+        web.post('/scan/{mode}/start', start_scan),
+        web.post('/scan/stop', stop_scan),
+        web.get('/ws', websocket),
+    ])
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+def serve(host='127.0.0.1', port=8765, replay=None, queue_size=256):
+    global s, current_device_id, calibration_profile
+    try:
+        from aiohttp import web
+    except ImportError:
+        raise SystemExit("service mode needs aiohttp (pip install aiohttp)")
+
+    if replay:
+        s = ConnectionManager('replay')
+        s.serial = ReplaySerial(replay, line_delay=0.01)
+        for path, error in s.serial.skipped:
+            print(f"replay: skipped {path} ({error})")
+    else:
+        init_uart()
+    current_device_id = s.device_id
+    calibration_profile = active_calibration_profile()
+
+    service = ScanService(queue_size)
+    service.calibration = calibration_profile
+    if service.calibration is None:
+        service.calibration = lookup_calibration_table()
+    try:
+        web.run_app(make_service_app(service), host=host, port=port)
+    finally:
+        close_uart()
+
+# -----------------------
+# Command line (GUI by default, headless sub-commands)
+# -----------------------
+
+def cli(argv=None):
+    global sweep_record_dir, serial_port, max_baudrate, map_export_dir, map_export_formats
+    parser = argparse.ArgumentParser(description="DCS Final Project - PC side")
+    parser.add_argument('--record-dir', help="save every GUI sweep as a replayable file in this folder")
+    parser.add_argument('--port', help="serial port of the MSP430 (default: auto-detect)")
+    parser.add_argument('--export-maps', metavar='DIR', help="auto-save every sweep map to this folder")
+    parser.add_argument('--export-formats', default='png', help="comma separated, e.g. png,svg")
+    parser.add_argument('--max-baud', type=int, choices=BAUD_RATES, default=BAUD_RATES[-1],
+                        help="highest baud rate to negotiate (9600 disables negotiation)")
+    sub = parser.add_subparsers(dest='command')
+
+    p = sub.add_parser('reanalyze', help="re-run light/object classification over recorded sweeps")
+    p.add_argument('paths', nargs='+', help="sweep files or folders holding sweep_*.txt")
+    p.add_argument('-o', '--output', default='reanalysis.json')
+    p.add_argument('--calibration', help="lookup table file (default: the calibration of the device "
+                                         "recorded in each sweep, from device_profiles.json)")
+    p.add_argument('--device', help="use this device's latest fitted profile (or its stored table) for every "
+                                    "sweep instead of the device recorded in each file")
+    p.add_argument('--max-distance', type=int, default=400, help="object masking distance [cm]")
+    p.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    p.add_argument('--chunk-size', type=int, default=64, help="sweep files per worker task")
+
+    p = sub.add_parser('serve', help="REST/WebSocket scan service for remote dashboards (needs aiohttp)")
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--http-port', type=int, default=8765)
+    p.add_argument('--queue-size', type=int, default=256, help="frames buffered per client before dropping")
+    p.add_argument('--replay', nargs='+', help="serve recorded sweeps instead of the MSP430")
+
+    args = parser.parse_args(argv)
+    serial_port = args.port
+    max_baudrate = args.max_baud
+    if args.command == 'serve':
+        serve(args.host, args.http_port, args.replay, args.queue_size)
+        return
+    if args.command == 'reanalyze':
+        summary = reanalyze(args.paths, args.output, args.calibration, args.max_distance,
+                            args.workers, args.chunk_size, args.device)
+        print(f"{summary['files']} sweeps ({summary['errors']} errors), "
+              f"{summary['lights_detected']} light hits -> {args.output}")
+        return
+
+    sweep_record_dir = args.record_dir
+    map_export_dir = args.export_maps
+    map_export_formats = tuple(fmt.strip() for fmt in args.export_formats.split(',') if fmt.strip())
+    main()
+
 
 if __name__ == '__main__':
-    command_dict = {
-        "inc_lcd": 0x01,
-        "dec_lcd": 0x02,
-        "rra_lcd": 0x03,
-        "set_delay": 0x04,
-        "clear_lcd": 0x05,
-        "servo_deg": 0x06,
-        "servo_scan": 0x07,
-        "sleep": 0x08
-    }
-    main()
\ No newline at end of file
+    cli()
\ No newline at end of file
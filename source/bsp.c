@@ -290,6 +290,24 @@ void UART_Init(){
       IE2 |= UCA0RXIE;                          // Enable USCI_A0 RX interrupt
 }
 
+//------------------------------------------------------------------------------
+//                     UART baud rate (negotiated by the PC side)
+//------------------------------------------------------------------------------
+// index: 0 - 9600, 1 - 19200, 2 - 38400, 3 - 57600, 4 - 115200 (SMCLK = 1MHz)
+
+void UART_set_baud(int index){
+    static const unsigned char baud_br0[BAUD_RATES_NUM]  = {104, 52, 26, 17, 8};
+    static const unsigned char baud_mctl[BAUD_RATES_NUM] = {UCBRS_1, UCBRS_0, UCBRS_0, UCBRS_3, UCBRS_6};
+
+    while (UCA0STAT & UCBUSY);                  // let the last char (ack) leave first
+    UCA0CTL1 |= UCSWRST;
+    UCA0BR0 = baud_br0[index];
+    UCA0BR1 = 0x00;
+    UCA0MCTL = baud_mctl[index];
+    UCA0CTL1 &= ~UCSWRST;
+    IE2 |= UCA0RXIE;                            // reset clears the RX interrupt enable
+}
+
              
 //------------------------------------------------------------------------------
 //                             FLASH configuration
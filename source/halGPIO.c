@@ -79,6 +79,12 @@ int timer_counter = 0;
 // Variables used for light calibration
 enum FSM_light_calibration state_light_calibration;
 
+// Variables used for baud rate negotiation
+int baud_flag = 0;        // 1 - rate index next, 2 - echoing the probe, 3 - waiting for commit
+int baud_index = 0;       // active rate, 0 = 9600 (UART_Init default)
+int baud_prev_index = 0;
+int baud_probe_count = 0;
+
 // Configs 
 
 void sysConfig(void){ 
@@ -540,6 +546,33 @@ void __attribute__ ((interrupt(USCIAB0RX_VECTOR))) USCI0RX_ISR (void)
             __bic_SR_register_on_exit(LPM0_bits);//out from sleep
         }
     }
+
+    // --------- Baud rate negotiation ---------
+    else if (baud_flag == 1){
+        baud_prev_index = baud_index;
+        baud_index = UCA0RXBUF - '0';
+        if (baud_index < 0 || baud_index >= BAUD_RATES_NUM)
+            baud_index = baud_prev_index;
+        while (!(IFG2 & UCA0TXIFG));
+        UCA0TXBUF = 'b';                        // ack at the old rate
+        UART_set_baud(baud_index);
+        baud_probe_count = 0;
+        baud_flag = 2;
+    }
+    else if (baud_flag == 2){
+        i = UCA0RXBUF;
+        while (!(IFG2 & UCA0TXIFG));
+        UCA0TXBUF = i;                          // echo the probe pattern
+        if (++baud_probe_count == BAUD_PROBE_LEN)
+            baud_flag = 3;
+    }
+    else if (baud_flag == 3){
+        if (UCA0RXBUF != 'Y'){                  // anything but a clean commit -> fall back
+            baud_index = baud_prev_index;
+            UART_set_baud(baud_index);
+        }
+        baud_flag = 0;
+    }
     else{
         switch(UCA0RXBUF){
             case 'q':
@@ -693,6 +726,10 @@ void __attribute__ ((interrupt(USCIAB0RX_VECTOR))) USCI0RX_ISR (void)
                 pb1_btn = pushed;
                 break;
 
+            case 'b': // baud rate negotiation, next byte is the rate index
+                baud_flag = 1;
+                break;
+
             default:
                 lcd_init();
                 lcd_puts("ERROR");
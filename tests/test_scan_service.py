@@ -0,0 +1,117 @@
+# REST/WebSocket scan service against recorded sweeps (ReplaySerial),
+# driven by aiohttp's test client; no MSP430 needed.
+import asyncio
+import os
+
+import pytest
+
+import main
+
+aiohttp = pytest.importorskip('aiohttp')
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SWEEP_SAMPLES = 40
+
+
+@pytest.fixture
+def replay_dir(tmp_path):
+    distances = [str(20 + (i * 7) % 90) for i in range(SWEEP_SAMPLES)]
+    (tmp_path / 'sweep_object_1.txt').write_text('\n'.join(['U dev', '0', '180'] + distances + ['500']) + '\n')
+    (tmp_path / 'sweep_empty.txt').write_text('')
+    (tmp_path / 'sweep_truncated.txt').write_text('U\n0\n180\n12\n13\n')
+    return tmp_path
+
+
+@pytest.fixture
+def service(monkeypatch, replay_dir):
+    link = main.ConnectionManager('replay')
+    link.serial = main.ReplaySerial([str(replay_dir)], line_delay=0.005)
+    monkeypatch.setattr(main, 's', link)
+    monkeypatch.setattr(main, 'object_map', main.OccupancyGrid())
+    monkeypatch.setattr(main.time, 'sleep', lambda seconds: None)
+    scan_service = main.ScanService(queue_size=256)
+    scan_service.calibration = main.load_calibration_table(os.path.join(REPO_DIR, 'calibration_values_2.txt'))
+    return scan_service
+
+
+def run(service, scenario):
+    async def main_task():
+        async with TestClient(TestServer(main.make_service_app(service))) as client:
+            return await scenario(client)
+    return asyncio.run(main_task())
+
+
+async def frames_until(ws, frame_type, timeout=5.0):
+    frames = []
+    while not frames or frames[-1]['type'] != frame_type:
+        frames.append(await ws.receive_json(timeout=timeout))
+    return frames
+
+
+def test_replay_skips_bad_files(service):
+    skipped = sorted(os.path.basename(path) for path, _ in main.s.serial.skipped)
+    assert skipped == ['sweep_empty.txt', 'sweep_truncated.txt']
+    assert list(main.s.serial.sweeps) == ['U']
+
+
+def test_start_conflict_errors_and_stop(service):
+    async def scenario(client):
+        response = await client.post('/scan/object/start', json={'continuous': True})
+        assert response.status == 200
+        assert (await response.json())['mode'] == 'object'
+
+        response = await client.post('/scan/light/start', json={})
+        assert response.status == 409
+
+        response = await client.post('/scan/stop')
+        assert response.status == 200
+        assert (await response.json())['mode'] is None
+
+        assert (await client.post('/scan/radar/start', json={})).status == 404
+        assert (await client.post('/scan/object/start', data='notjson')).status == 400
+        assert (await client.post('/scan/object/start', json=[1, 2])).status == 400
+        assert (await (await client.get('/status')).json())['mode'] is None
+    run(service, scenario)
+
+
+def test_frames_fan_out_to_every_client(service):
+    async def scenario(client):
+        first = await client.ws_connect('/ws')
+        second = await client.ws_connect('/ws')
+        assert (await first.receive_json())['type'] == 'status'
+        assert (await second.receive_json())['type'] == 'status'
+
+        assert (await client.post('/scan/object/start', json={'max_distance': 100})).status == 200
+        received = [await frames_until(ws, 'sweep') for ws in (first, second)]
+        await client.post('/scan/stop')
+        await first.close()
+        await second.close()
+        return received
+
+    first, second = run(service, scenario)
+    assert first == second
+    samples = [frame for frame in first if frame['type'] == 'sample']
+    assert [frame['index'] for frame in samples] == list(range(SWEEP_SAMPLES))
+    sweep = first[-1]
+    assert sweep['mode'] == 'object'
+    assert len(sweep['distance_arr']) == SWEEP_SAMPLES - main.SCAN_MODES['U'][1]
+
+
+def test_slow_client_drops_oldest_frames(service):
+    service.queue_size = 4
+
+    async def scenario(client):
+        stalled = service.subscribe()  # never read
+        assert (await client.post('/scan/object/start', json={})).status == 200
+        while service.mode is not None:
+            await asyncio.sleep(0.01)
+        status = await (await client.get('/status')).json()
+        kept = [stalled.get_nowait() for _ in range(stalled.qsize())]
+        return status, kept
+
+    status, kept = run(service, scenario)
+    # status + one frame per sample + sweep + final status, all but 4 dropped
+    assert status['dropped'] == status['frames'] - 4 > 0
+    assert len(kept) == 4
+    assert [frame['type'] for frame in kept[-2:]] == ['sweep', 'status']
@@ -0,0 +1,269 @@
+# Regression and fuzz tests for the PC-side serial protocol parsers.
+# The MSP430 is replaced by SimulatedSerial, a byte stream with hostile
+# framing; the fast paths are checked against the original implementations.
+import os
+import time
+
+import numpy as np
+import pytest
+import serial as ser
+
+import main
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUNDS = 200
+MIN_SPEEDUP = 1.3        # read_line over the legacy reader, lines/s
+THROUGHPUT_REPEATS = 5
+MAX_PARSE_S = 2.0        # a bad stream must fail within this
+
+
+class SimulatedSerial:
+    # Data "arrives" in random chunks, so one read may return part of a line
+    # (split reads) or several lines' worth of bytes (coalesced frames), and
+    # some reads time out empty.  Once exhausted every read times out, like a
+    # silent MSP.
+
+    def __init__(self, data, rng=None, max_chunk=16, stall_rate=0.05):
+        self.rng = rng or np.random.default_rng(0)
+        self._data = bytes(data)
+        self._pos = 0
+        self._arrived = b''
+        self.max_chunk = max_chunk
+        self.stall_rate = stall_rate
+        self.written = bytearray()
+        self.baudrate = main.BAUD_RATES[0]
+
+    def _arrive(self):
+        if self._arrived or self._pos >= len(self._data):
+            return
+        if self.rng.random() < self.stall_rate:
+            return
+        size = int(self.rng.integers(1, self.max_chunk + 1))
+        self._arrived = self._data[self._pos:self._pos + size]
+        self._pos += size
+
+    @property
+    def in_waiting(self):
+        self._arrive()
+        return len(self._arrived)
+
+    def read(self, size=1):
+        self._arrive()
+        chunk, self._arrived = self._arrived[:size], self._arrived[size:]
+        return chunk
+
+    def read_until(self, expected=b'\n', size=None):
+        # Like pyserial: stops after `expected`, otherwise returns what came
+        # in before the timeout.
+        out = b''
+        while True:
+            self._arrive()
+            if not self._arrived:
+                return out
+            end = self._arrived.find(expected)
+            if end >= 0:
+                end += len(expected)
+                out += self._arrived[:end]
+                self._arrived = self._arrived[end:]
+                return out
+            out += self._arrived
+            self._arrived = b''
+            if self.rng.random() < 0.5:  # timeout mid-line
+                return out
+
+    def write(self, data):
+        self.written += data
+        return len(data)
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SimulatedLink(main.ConnectionManager):
+    # A dead simulated port cannot come back: reconnecting fails outright.
+
+    def __init__(self, data, rng=None, **kwargs):
+        super().__init__('simulated', line_timeout=0.05)
+        self.serial = SimulatedSerial(data, rng, **kwargs)
+        self.drops = 0
+
+    def reconnect(self):
+        self.drops += 1
+        raise ser.SerialException("simulated link dropped")
+
+
+def legacy_read_line(port):
+    # receive_data() as it was: one byte per read call
+    chr_ = b''
+    while chr_[-1:] != b'\n':
+        chr_ += port.read(1)
+    return chr_
+
+
+def legacy_find_fitting_index(ldr1_value, ldr2_value, calibration_arr):
+    average_ldr_value = (ldr1_value + ldr2_value) / 2
+    min_diff = float("inf")
+    fitting_index = 0
+    for i, val in enumerate(calibration_arr):
+        diff = abs(val - average_ldr_value)
+        if diff < min_diff:
+            min_diff = diff
+            fitting_index = i
+    return fitting_index
+
+
+def random_sweep_lines(rng, scan_cmd, samples=40):
+    # A valid recorded sweep (see main.parse_sweep) for `scan_cmd` 'U', 'Y' or 'Z'.
+    lines = [scan_cmd, '0', '180']
+    for _ in range(samples):
+        if scan_cmd in 'UZ':
+            lines.append(str(int(rng.integers(0, main.OBJECT_SWEEP_END))))
+        if scan_cmd in 'YZ':
+            lines.append(str(int(rng.integers(0, main.LDR_SWEEP_END + 1))))
+            lines.append(str(int(rng.integers(0, main.LDR_SWEEP_END + 1))))
+    lines.append({'U': str(main.OBJECT_SWEEP_END), 'Y': str(main.LDR_SWEEP_END + 1),
+                  'Z': str(main.LIGHT_OBJECT_SWEEP_END)}[scan_cmd])
+    return [line + '\n' for line in lines]
+
+
+def live_parse(scan_cmd):
+    # What a scan window does on the link: angles, then samples to the terminator.
+    int(main.receive_data()), int(main.receive_data())
+    return list(main.iter_sweep_samples(main.SCAN_MODES[scan_cmd][0], iter(main.receive_data, None)))
+
+
+@pytest.fixture
+def link(monkeypatch):
+    # Installs a SimulatedLink as the module's serial handle.
+    def install(data, rng=None, **kwargs):
+        simulated = SimulatedLink(data, rng, **kwargs)
+        monkeypatch.setattr(main, 's', simulated)
+        return simulated
+    return install
+
+
+@pytest.fixture
+def table():
+    return main.load_calibration_table(os.path.join(REPO_DIR, 'calibration_values_2.txt'))
+
+
+@pytest.mark.parametrize('scan_cmd', 'UYZ')
+def test_framing_matches_legacy_reader(scan_cmd):
+    rng = np.random.default_rng(ord(scan_cmd))
+    for i in range(ROUNDS):
+        lines = random_sweep_lines(rng, scan_cmd, int(rng.integers(1, 60)))
+        data = ''.join(lines[1:]).encode('ascii')
+        fast = SimulatedLink(data, np.random.default_rng(i), max_chunk=int(rng.integers(1, 64)))
+        legacy = SimulatedSerial(data, np.random.default_rng(i + ROUNDS))
+        expected = [line.encode('ascii') for line in lines[1:]]
+        assert [fast.read_line(1.0) for _ in expected] == expected
+        assert [legacy_read_line(legacy) for _ in expected] == expected
+
+
+@pytest.mark.parametrize('scan_cmd', 'UYZ')
+def test_live_parse_matches_recording(link, scan_cmd):
+    rng = np.random.default_rng(ord(scan_cmd))
+    for i in range(ROUNDS):
+        lines = random_sweep_lines(rng, scan_cmd, int(rng.integers(1, 60)))
+        link(''.join(lines[1:]).encode('ascii'), np.random.default_rng(i))
+        assert live_parse(scan_cmd) == main.parse_sweep(lines)['samples']
+
+
+@pytest.mark.parametrize('scan_cmd', 'UYZ')
+def test_garbage_is_rejected(link, scan_cmd):
+    # Every byte of a sweep is a digit or '\n', so swapping any of them for a
+    # non-digit byte must break a line (or merge two into an invalid one).
+    # The final '\n' is left alone: without it the stream is just truncated.
+    rng = np.random.default_rng(ord(scan_cmd))
+    for i in range(ROUNDS):
+        data = bytearray(''.join(random_sweep_lines(rng, scan_cmd, 10)[1:]).encode('ascii'))
+        pos = int(rng.integers(0, len(data) - 1))
+        data[pos] = int(rng.choice([0x00, 0x7f, 0xff, ord('x')]))
+        link(bytes(data), np.random.default_rng(i))
+        start = time.monotonic()
+        with pytest.raises(ValueError):
+            live_parse(scan_cmd)
+        assert time.monotonic() - start < MAX_PARSE_S
+
+
+@pytest.mark.parametrize('scan_cmd', 'UYZ')
+def test_truncated_stream_drops_the_link(link, scan_cmd):
+    rng = np.random.default_rng(ord(scan_cmd))
+    for i in range(ROUNDS // 4):
+        data = ''.join(random_sweep_lines(rng, scan_cmd, 10)[1:]).encode('ascii')
+        simulated = link(data[:int(rng.integers(0, len(data)))], np.random.default_rng(i))
+        start = time.monotonic()
+        with pytest.raises(ser.SerialException, match="simulated link dropped"):
+            live_parse(scan_cmd)
+        assert simulated.drops == 1
+        assert time.monotonic() - start < MAX_PARSE_S
+
+
+def test_ldr_sentinel(link):
+    link(b'1024\n')
+    assert main.measure_two_ldr_samples(np.zeros(50)) == [-1, 0, 0]
+    link(b'1023\n1023\n')
+    assert main.measure_two_ldr_samples(np.zeros(50))[0] != -1
+    sweep = main.parse_sweep(['Z\n', '0\n', '180\n', '12\n', '1024\n', '13\n', '300\n', '301\n', '9999\n'])
+    assert sweep['samples'] == [(12, None, None), (13, 300 / main.LDR_SCALE, 301 / main.LDR_SCALE)]
+
+
+def test_sweep_terminators():
+    assert main.parse_sweep(['U\n', '0\n', '180\n', '12\n', '500\n', '13\n'])['samples'] == [(12,)]
+    assert len(main.parse_sweep(['Y\n', '0\n', '180\n', '1\n', '2\n', '1024\n'])['samples']) == 1
+    assert len(main.parse_sweep(['Z\n', '0\n', '180\n', '12\n', '300\n', '301\n', '9999\n'])['samples']) == 1
+
+
+def test_truncated_recording_raises_value_error():
+    with pytest.raises(ValueError):
+        main.parse_sweep(['Y\n', '0\n', '180\n', '1\n'])
+
+
+def test_receive_ack_stops_at_nul(link):
+    link(b'3\0garbage', max_chunk=64, stall_rate=0)
+    main.receive_ack()
+    assert main.ACK == '3\0'
+
+
+def test_file_command_encoder():
+    script = "inc_lcd 20\nservo_deg 90\nservo_scan 30,150\n\nbogus 1\nsleep\n"
+    assert main.file_command_encoder(script) == "0114\n065A\n071E96\n08\n"
+
+
+def test_find_fitting_index_matches_legacy_loop(table):
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.uniform(0, main.LDR_SWEEP_END / main.LDR_SCALE, (ROUNDS, 2)),
+                             np.repeat(table[:, None], 2, axis=1)])  # exact ties
+    for ldr1, ldr2 in values:
+        assert main.find_fitting_index(ldr1, ldr2, table) == legacy_find_fitting_index(ldr1, ldr2, table)
+
+
+def test_read_line_throughput():
+    # Calibrated against the byte-per-call reader on the same port, best of
+    # several repeats so one slow run does not decide; 64-byte reads are the
+    # MSP430 USB CDC packet size.  Measured ~1.7x here.
+    rng = np.random.default_rng(0)
+    data = ''.join(random_sweep_lines(rng, 'Z', 2000)[1:]).encode('ascii')
+    count = data.count(b'\n')
+
+    def best_rate(make_port, read):
+        best = 0.0
+        for repeat in range(THROUGHPUT_REPEATS):
+            port = make_port(np.random.default_rng(repeat))
+            start = time.perf_counter()
+            for _ in range(count):
+                read(port)
+            best = max(best, count / (time.perf_counter() - start))
+        return best
+
+    fast_rate = best_rate(lambda rng: SimulatedLink(data, rng, max_chunk=64, stall_rate=0),
+                          lambda port: port.read_line(1.0))
+    legacy_rate = best_rate(lambda rng: SimulatedSerial(data, rng, max_chunk=64, stall_rate=0),
+                            legacy_read_line)
+    assert fast_rate >= MIN_SPEEDUP * legacy_rate